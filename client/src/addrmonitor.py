@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Interface Address Monitor for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import errno
+import logging
+import socket
+import struct
+import threading
+import time
+from ipaddress import ip_address
+
+try:
+    import netifaces
+except ImportError:
+    netifaces = None
+
+
+# ###### Constants ##########################################################
+# rtnetlink multicast groups of IPv4 and IPv6 address changes
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+# rtnetlink message types
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+# netlink request flags
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+# netlink message header: length, type, flags, sequence, port
+NLMSG_HEADER = struct.Struct("=IHHII")
+# address message: family, prefix length, flags, scope, interface index
+IFADDRMSG = struct.Struct("=BBBBI")
+# route attribute header: length, type
+RTATTR_HEADER = struct.Struct("=HH")
+# address attributes
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_FLAGS = 8
+# address flags of addresses not usable as source
+IFA_F_UNUSABLE = 0x08 | 0x20 | 0x40  # DADFAILED, DEPRECATED, TENTATIVE
+# address flag of secondary addresses
+IFA_F_SECONDARY = 0x01
+# address scope reachable from anywhere
+RT_SCOPE_UNIVERSE = 0
+# size of the netlink receive buffer (in bytes)
+NETLINK_BUFFER_SIZE = 65536
+# interval of polling, without netlink, and of checking a stop event (in s)
+POLL_INTERVAL = 1.0
+
+
+def netlink_align(length: int) -> int:
+    """Align a length on netlink 4-byte boundaries
+
+    Args:
+        length (int): length (in bytes)
+
+    Returns:
+        int: aligned length
+    """
+    return (length + 3) & ~3
+
+
+class InterfaceAddress:
+    """Class describing an address of a network interface"""
+
+    def __init__(self, address, scope: int = RT_SCOPE_UNIVERSE, flags: int = 0):
+        """
+        Args:
+            address (ip_address): local address
+            scope (int): address scope, RT_SCOPE_UNIVERSE being global
+            flags (int): address flags
+        """
+        self.address = address
+        self.scope = scope
+        self.flags = flags
+
+    def rank(self) -> tuple:
+        """Get rank of the address as source, lowest first
+
+        Returns:
+            tuple: usability, scope and primary address first
+        """
+        return (
+            bool(self.flags & IFA_F_UNUSABLE),
+            self.scope != RT_SCOPE_UNIVERSE,
+            bool(self.flags & IFA_F_SECONDARY),
+        )
+
+
+def parse_address_message(payload: bytes) -> tuple:
+    """Parse an RTM_NEWADDR or RTM_DELADDR message
+
+    Args:
+        payload (bytes): message without netlink header
+
+    Returns:
+        tuple: interface index, label (None if absent) and InterfaceAddress,
+            None if the message has no address
+    """
+    family, _, flags, scope, index = IFADDRMSG.unpack_from(payload)
+    attributes = {}
+    offset = netlink_align(IFADDRMSG.size)
+    while offset + RTATTR_HEADER.size <= len(payload):
+        length, kind = RTATTR_HEADER.unpack_from(payload, offset)
+        if length < RTATTR_HEADER.size:
+            break
+        attributes[kind] = payload[offset + RTATTR_HEADER.size : offset + length]
+        offset += netlink_align(length)
+    # on point-to-point links, IFA_ADDRESS is the peer and IFA_LOCAL is ours
+    address = attributes.get(IFA_LOCAL, attributes.get(IFA_ADDRESS))
+    if (address is None) or (family not in [socket.AF_INET, socket.AF_INET6]):
+        return None
+    if IFA_FLAGS in attributes:
+        flags = struct.unpack("=I", attributes[IFA_FLAGS][:4])[0]
+    label = attributes.get(IFA_LABEL)
+    if label is not None:
+        label = label.split(b"\0", 1)[0].decode("utf-8", "replace")
+    return (
+        index,
+        label,
+        InterfaceAddress(ip_address(socket.inet_ntop(family, address)), scope, flags),
+    )
+
+
+class AddressMonitor:
+    """Class keeping the addresses of the network interfaces in memory
+
+    Addresses are dumped once, then kept up to date from rtnetlink address
+    events, so looking an address up costs no system call and waiting for
+    an address wakes up as soon as it is added. Without netlink (or if its
+    socket fails), addresses are polled with netifaces.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # addresses per interface name, in order of addition
+        self.addresses = {}
+        self.netlink = None
+        self.events = 0
+        self.resyncs = 0
+        try:
+            self.netlink = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE
+            )
+            self.netlink.bind((0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+            self.netlink.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, NETLINK_BUFFER_SIZE
+            )
+        except (AttributeError, OSError) as e:
+            logging.warning("Cannot monitor addresses with netlink, polling: %s", e)
+            self.netlink = None
+            return
+        self.request_dump()
+        threading.Thread(target=self._run, name="addrmonitor", daemon=True).start()
+
+    def request_dump(self):
+        """Request a dump of all addresses, replacing the cache"""
+        with self.condition:
+            self.addresses = {}
+        request = IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        self.netlink.send(
+            NLMSG_HEADER.pack(
+                NLMSG_HEADER.size + len(request),
+                RTM_GETADDR,
+                NLM_F_REQUEST | NLM_F_DUMP,
+                1,
+                0,
+            )
+            + request
+        )
+
+    def _run(self):
+        """Apply the address messages received from netlink"""
+        while True:
+            try:
+                data = self.netlink.recv(NETLINK_BUFFER_SIZE)
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # events were lost, the cache is rebuilt
+                    self.resyncs += 1
+                    logging.warning("Address events lost, dumping addresses again")
+                    self.request_dump()
+                    continue
+                logging.warning("Address monitor stopped: %s", e)
+                return
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, kind, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+                if length < NLMSG_HEADER.size:
+                    break
+                if kind in [RTM_NEWADDR, RTM_DELADDR]:
+                    self.apply(
+                        kind,
+                        data[offset + NLMSG_HEADER.size : offset + length],
+                    )
+                offset += netlink_align(length)
+
+    def apply(self, kind: int, payload: bytes):
+        """Apply an address message to the cache
+
+        Args:
+            kind (int): RTM_NEWADDR or RTM_DELADDR
+            payload (bytes): message without netlink header
+        """
+        parsed = parse_address_message(payload)
+        if parsed is None:
+            return
+        index, label, address = parsed
+        try:
+            name = socket.if_indextoname(index)
+        except OSError:
+            # interface already gone, IPv4 labels start with its name
+            if label is None:
+                return
+            name = label.split(":", 1)[0]
+        with self.condition:
+            self.events += 1
+            addresses = [
+                known
+                for known in self.addresses.get(name, [])
+                if known.address != address.address
+            ]
+            if kind == RTM_NEWADDR:
+                addresses.append(address)
+            self.addresses[name] = addresses
+            logging.debug(
+                "Address %s %s on %s",
+                address.address,
+                "added" if kind == RTM_NEWADDR else "removed",
+                name,
+            )
+            self.condition.notify_all()
+
+    def poll(self, name: str, ip_version: int) -> list:
+        """Get the addresses of an interface with netifaces
+
+        Args:
+            name (str): interface name
+            ip_version (int): IP version in [4, 6]
+
+        Returns:
+            list: InterfaceAddress of the interface
+        """
+        if netifaces is None:
+            return []
+        af = netifaces.AF_INET if ip_version == 4 else netifaces.AF_INET6
+        try:
+            entries = netifaces.ifaddresses(name).get(af, [])
+        except ValueError:
+            return []
+        # IPv6 link-local addresses carry a "%interface" zone
+        return [
+            InterfaceAddress(ip_address(entry["addr"].split("%", 1)[0]))
+            for entry in entries
+        ]
+
+    def address(self, name: str, ip_version: int = 4):
+        """Get the best source address of an interface
+
+        Args:
+            name (str): interface name
+            ip_version (int): IP version in [4, 6]
+
+        Returns:
+            ip_address: usable global address first, None if there is none
+        """
+        if ip_version not in [4, 6]:
+            raise ValueError(
+                f"ip_version {ip_version} is not within authorized values [4, 6]"
+            )
+        if self.netlink is None:
+            addresses = self.poll(name, ip_version)
+        else:
+            with self.condition:
+                addresses = [
+                    known
+                    for known in self.addresses.get(name, [])
+                    if known.address.version == ip_version
+                ]
+        if not addresses:
+            return None
+        # sorting is stable, so the oldest address wins among equals
+        return sorted(addresses, key=InterfaceAddress.rank)[0].address
+
+    def wait_for_address(
+        self,
+        name: str,
+        timeout: float,
+        ip_version: int = 4,
+        stop: threading.Event = None,
+    ):
+        """Wait for an interface to have an address
+
+        Args:
+            name (str): interface name
+            timeout (float): maximum time to wait (in s)
+            ip_version (int): IP version in [4, 6]
+            stop (threading.Event): event ending the wait early, if set
+
+        Returns:
+            ip_address: address of the interface, None on timeout or stop
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                address = self.address(name, ip_version)
+                remaining = deadline - time.monotonic()
+                if (
+                    (address is not None)
+                    or (remaining <= 0)
+                    or ((stop is not None) and stop.is_set())
+                ):
+                    return address
+                # address events notify, polling and the stop event do not
+                self.condition.wait(
+                    min(remaining, POLL_INTERVAL)
+                    if (self.netlink is None) or (stop is not None)
+                    else remaining
+                )
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Daily Result Bundles for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import pathlib
+import sys
+import tarfile
+
+
+# ###### Constants ##########################################################
+# suffix of the table of contents, both as bundle member and side file
+TOC_SUFFIX = ".toc.json"
+
+
+def read_toc(bundle_path: str) -> dict:
+    """Read the table of contents of a bundle
+
+    Args:
+        bundle_path (str): path to the bundle
+
+    Returns:
+        dict: bundle end offset and members, empty if there is none yet
+    """
+    try:
+        with open(bundle_path + TOC_SUFFIX) as toc_file:
+            return json.load(toc_file)
+    except FileNotFoundError:
+        return {"end": 0, "members": []}
+
+
+def write_toc(bundle_path: str, toc: dict):
+    """Write the table of contents of a bundle, atomically
+
+    Args:
+        bundle_path (str): path to the bundle
+        toc (dict): table of contents
+    """
+    tmp_file = f"{bundle_path}{TOC_SUFFIX}.tmp"
+    with open(tmp_file, "w") as toc_file:
+        json.dump(toc, toc_file)
+        toc_file.flush()
+        os.fsync(toc_file.fileno())
+    os.replace(tmp_file, bundle_path + TOC_SUFFIX)
+
+
+@contextlib.contextmanager
+def open_bundle(bundle_path: str, end: int):
+    """Open a bundle to append members after a given offset
+
+    Anything after the offset, such as the end-of-archive blocks or a member
+    left incomplete by a crash, is cut before appending.
+
+    Args:
+        bundle_path (str): path to the bundle, created if missing
+        end (int): offset after the last member to keep
+
+    Yields:
+        tarfile.TarFile: archive open for writing at the offset
+    """
+    with open(bundle_path, "a+b") as bundle_file:
+        bundle_file.truncate(end)
+        bundle_file.seek(end)
+        with tarfile.open(
+            fileobj=bundle_file, mode="w", format=tarfile.PAX_FORMAT
+        ) as bundle:
+            yield bundle
+        bundle_file.flush()
+        os.fsync(bundle_file.fileno())
+
+
+def extract_member(bundle_path: str, name: str) -> bytes:
+    """Read one member of a bundle using its table of contents
+
+    Args:
+        bundle_path (str): path to the bundle
+        name (str): member name
+
+    Returns:
+        bytes: member content
+    """
+    for member in read_toc(bundle_path)["members"]:
+        if member["name"] == name:
+            with open(bundle_path, "rb") as bundle_file:
+                bundle_file.seek(member["offset"])
+                return bundle_file.read(member["size"])
+    raise KeyError(f"{name} is not in {bundle_path}")
+
+
+class DailyBundler:
+    """Class appending the results of every run to one tar bundle per day
+
+    Bundles of the current day are appended in a staging directory, next to
+    their table of contents. Each entry of the table of contents gives the
+    run, the data offset and the size of a member, so one file can be read
+    without scanning the archive. Bundles of past days are sealed, with the
+    table of contents as last member, and moved to the result directory.
+    """
+
+    def __init__(self, staging_directory: str, instance: int):
+        """
+        Args:
+            staging_directory (str): directory of the open bundles
+            instance (int): measurement instance ID
+        """
+        self.staging_directory = staging_directory
+        self.instance = instance
+        os.makedirs(staging_directory, 0o755, True)
+
+    def bundle_path(self, day: str) -> str:
+        """Get path of the bundle of a day
+
+        Args:
+            day (str): day as YYYY-MM-DD
+
+        Returns:
+            str: path to the open bundle
+        """
+        return f"{self.staging_directory}/netperfmeter_{self.instance}_bundle_{day}.tar"
+
+    def append(self, run: str, file_paths: list, day: str):
+        """Append the files of a run to the bundle of its day
+
+        Only members recorded in the table of contents are kept, so a run
+        interrupted while being appended is dropped cleanly. Files of the run
+        already recorded are skipped, so a run resumed after a crash is not
+        appended twice.
+
+        Args:
+            run (str): run identifier
+            file_paths (list): paths to the files of the run
+            day (str): day as YYYY-MM-DD
+        """
+        bundle_path = self.bundle_path(day)
+        toc = read_toc(bundle_path)
+        appended = {member["name"] for member in toc["members"] if member["run"] == run}
+        file_paths = [
+            file_path
+            for file_path in file_paths
+            if os.path.basename(file_path) not in appended
+        ]
+        if not file_paths:
+            return
+        with open_bundle(bundle_path, toc["end"]) as bundle:
+            for file_path in file_paths:
+                bundle.add(file_path, arcname=os.path.basename(file_path))
+                info = bundle.members[-1]
+                # data is the last thing written, padded to whole blocks
+                blocks = -(-info.size // tarfile.BLOCKSIZE)
+                toc["members"].append(
+                    {
+                        "name": info.name,
+                        "run": run,
+                        "offset": bundle.offset - blocks * tarfile.BLOCKSIZE,
+                        "size": info.size,
+                    }
+                )
+            toc["end"] = bundle.offset
+        write_toc(bundle_path, toc)
+
+    def seal(self, day: str) -> list:
+        """Seal the bundle of a day, appending its table of contents
+
+        Args:
+            day (str): day as YYYY-MM-DD
+
+        Returns:
+            list: paths to the sealed bundle and its table of contents
+        """
+        bundle_path = self.bundle_path(day)
+        toc = read_toc(bundle_path)
+        content = json.dumps(toc).encode("utf-8")
+        with open_bundle(bundle_path, toc["end"]) as bundle:
+            info = tarfile.TarInfo(pathlib.Path(bundle_path).name + TOC_SUFFIX)
+            info.size = len(content)
+            bundle.addfile(info, io.BytesIO(content))
+        return [bundle_path, bundle_path + TOC_SUFFIX]
+
+    def past_days(self, day: str) -> list:
+        """Get days before the given one with an open bundle
+
+        Args:
+            day (str): current day as YYYY-MM-DD
+
+        Returns:
+            list: days as YYYY-MM-DD
+        """
+        prefix = f"netperfmeter_{self.instance}_bundle_"
+        days = []
+        for bundle_path in glob.glob(f"{self.staging_directory}/{prefix}*.tar"):
+            bundle_day = pathlib.Path(bundle_path).stem[len(prefix) :]
+            if bundle_day < day:
+                days.append(bundle_day)
+        return sorted(days)
+
+
+if __name__ == "__main__":
+    # ###### Extract bundle member ##############################################
+    ap = argparse.ArgumentParser(description="Extract a file from a result bundle")
+    ap.add_argument("bundle", help="Path to the bundle", type=str)
+    ap.add_argument("name", help="Member name, list members if unset", nargs="?")
+    options = ap.parse_args()
+    try:
+        if options.name is None:
+            for member in read_toc(options.bundle)["members"]:
+                sys.stdout.write(f"{member['run']} {member['size']} {member['name']}\n")
+        else:
+            sys.stdout.buffer.write(extract_member(options.bundle, options.name))
+    except Exception as e:
+        sys.stderr.write(f"ERROR: Unable to read bundle: {e}\n")
+        sys.exit(1)
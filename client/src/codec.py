@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Result Codecs for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+# Ubuntu/Debian optional dependencies:
+# python3-zstandard (zstd codec only)
+
+import argparse
+import bz2
+import lzma
+import os
+import pathlib
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# ###### Constants ##########################################################
+class CodecName(Enum):
+    """Class enum for available result codecs"""
+
+    XZ = "xz"
+    ZSTD = "zstd"
+    BZ2 = "bz2"
+    NONE = "none"
+
+
+# logger of the codec reports, with a handler of its own
+CODEC_LOGGER = "codec"
+# size of the chunks streamed when transcoding results (in B)
+CHUNK_SIZE = 1024 * 1024
+# size of the independent blocks compressed by multi-threaded xz (in B)
+XZ_BLOCK_SIZE = 4 * 1024 * 1024
+# default compression level per codec
+DEFAULT_XZ_LEVEL = 6
+DEFAULT_ZSTD_LEVEL = 9
+# default size of a trained zstd dictionary (in B)
+DEFAULT_ZSTD_DICTIONARY_SIZE = 112640
+
+
+class CodecReport:
+    """Class holding the cost and gain of transcoding one file"""
+
+    def __init__(self, source: str, destination: str):
+        self.source = source
+        self.destination = destination
+        # size of the netperfmeter bzip2 file
+        self.input_bytes = 0
+        # size of the decompressed data
+        self.raw_bytes = 0
+        # size of the produced file
+        self.output_bytes = 0
+        # process CPU time spent (all threads) and wall-clock time spent
+        self.cpu_seconds = 0.0
+        self.wall_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        """Get report as a dictionary
+
+        Returns:
+            dict: report fields
+        """
+        return {
+            "source": self.source,
+            "destination": self.destination,
+            "input_bytes": self.input_bytes,
+            "raw_bytes": self.raw_bytes,
+            "output_bytes": self.output_bytes,
+            "ratio": compression_ratio(self.raw_bytes, self.output_bytes),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "wall_seconds": round(self.wall_seconds, 6),
+        }
+
+
+def compression_ratio(raw_bytes: int, output_bytes: int) -> float:
+    """Get compression ratio as raw size over compressed size
+
+    Args:
+        raw_bytes (int): size of the uncompressed data
+        output_bytes (int): size of the compressed data
+
+    Returns:
+        float: compression ratio, 0 when nothing was written
+    """
+    if output_bytes == 0:
+        return 0.0
+    return round(raw_bytes / output_bytes, 3)
+
+
+def summarize_reports(reports: list) -> dict:
+    """Aggregate the reports of a run
+
+    Args:
+        reports (list): CodecReport of every file of the run
+
+    Returns:
+        dict: summed sizes and times with the overall compression ratio
+    """
+    summary = {
+        "files": len(reports),
+        "input_bytes": sum(report.input_bytes for report in reports),
+        "raw_bytes": sum(report.raw_bytes for report in reports),
+        "output_bytes": sum(report.output_bytes for report in reports),
+        "cpu_seconds": round(sum(report.cpu_seconds for report in reports), 6),
+        "wall_seconds": round(sum(report.wall_seconds for report in reports), 6),
+    }
+    summary["ratio"] = compression_ratio(summary["raw_bytes"], summary["output_bytes"])
+    return summary
+
+
+class CorruptSourceError(Exception):
+    """Exception raised when a bzip2 file cannot be decompressed, e.g. when
+    netperfmeter was killed while writing it"""
+
+
+class SourceReader:
+    """Class reading a decompressed bzip2 stream, raising CorruptSourceError
+    on read errors, which retrying does not fix"""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            return self.reader.read(size)
+        except (EOFError, OSError) as e:
+            raise CorruptSourceError(str(e)) from e
+
+
+class Codec:
+    """Base class for codecs transcoding netperfmeter bzip2 results"""
+
+    name = None
+    extension = None
+
+    def __init__(self, level: int = None, threads: int = 1):
+        self.level = level
+        self.threads = threads if threads > 0 else (os.cpu_count() or 1)
+
+    def destination_path(self, source: pathlib.Path) -> pathlib.Path:
+        """Get path of the file produced from a bzip2 file
+
+        Args:
+            source (pathlib.Path): path to the bzip2 file
+
+        Returns:
+            pathlib.Path: path to the produced file
+        """
+        return source.with_suffix(self.extension)
+
+    def encode(self, reader, destination: pathlib.Path) -> int:
+        """Encode a decompressed stream into the destination file
+
+        Args:
+            reader: binary stream of decompressed data
+            destination (pathlib.Path): path to the produced file
+
+        Returns:
+            int: number of decompressed bytes read
+        """
+        raise NotImplementedError
+
+    def transcode(
+        self, file_path: str, keep_source: bool = False, directory: str = None
+    ) -> CodecReport:
+        """Transcode a netperfmeter bzip2 file by streaming it in chunks
+
+        Args:
+            file_path (str): path to the bzip2 file
+            keep_source (bool): keep the bzip2 file after transcoding
+            directory (str): directory of the produced file, the one of the
+                bzip2 file if None
+
+        Returns:
+            CodecReport: report of the transcoding
+
+        Raises:
+            CorruptSourceError: if the bzip2 file cannot be decompressed
+        """
+        source = pathlib.Path(file_path)
+        destination = self.destination_path(source)
+        if directory is not None:
+            destination = pathlib.Path(directory) / destination.name
+        report = CodecReport(str(source), str(destination))
+        report.input_bytes = source.stat().st_size
+        cpu_start = time.process_time()
+        wall_start = time.monotonic()
+        try:
+            with bz2.open(source, "rb") as reader:
+                report.raw_bytes = self.encode(SourceReader(reader), destination)
+        except BaseException:
+            # do not leave a truncated file behind
+            destination.unlink(missing_ok=True)
+            raise
+        report.cpu_seconds = time.process_time() - cpu_start
+        report.wall_seconds = time.monotonic() - wall_start
+        report.output_bytes = destination.stat().st_size
+        if not keep_source:
+            os.remove(source)
+        return report
+
+
+def copy_stream(reader, writer) -> int:
+    """Copy a binary stream into another one chunk by chunk
+
+    Args:
+        reader: binary stream to read from
+        writer: binary stream to write to
+
+    Returns:
+        int: number of bytes copied
+    """
+    total = 0
+    while True:
+        chunk = reader.read(CHUNK_SIZE)
+        if not chunk:
+            return total
+        writer.write(chunk)
+        total += len(chunk)
+
+
+class XzCodec(Codec):
+    """Codec compressing results to xz, optionally with several threads
+
+    With more than one thread, the data is cut in blocks compressed as
+    independent xz streams in parallel. Concatenated xz streams form a valid
+    xz file, like the output of "xz -T".
+    """
+
+    name = CodecName.XZ
+    extension = ".xz"
+
+    def __init__(self, level: int = None, threads: int = 1):
+        super().__init__(DEFAULT_XZ_LEVEL if level is None else level, threads)
+
+    def encode(self, reader, destination: pathlib.Path) -> int:
+        if self.threads == 1:
+            with lzma.open(destination, "wb", preset=self.level) as writer:
+                return copy_stream(reader, writer)
+        total = 0
+        pending = []
+        with open(destination, "wb") as writer, ThreadPoolExecutor(
+            self.threads
+        ) as executor:
+            while True:
+                block = reader.read(XZ_BLOCK_SIZE)
+                if block:
+                    total += len(block)
+                    pending.append(
+                        executor.submit(
+                            lzma.compress,
+                            block,
+                            format=lzma.FORMAT_XZ,
+                            preset=self.level,
+                        )
+                    )
+                # keep at most two blocks per thread in memory
+                while pending and (not block or len(pending) >= 2 * self.threads):
+                    writer.write(pending.pop(0).result())
+                if not block:
+                    return total
+
+
+class ZstdCodec(Codec):
+    """Codec compressing results to zstd, optionally with a trained dictionary"""
+
+    name = CodecName.ZSTD
+    extension = ".zst"
+
+    def __init__(self, level: int = None, threads: int = 1, dictionary: str = None):
+        if zstandard is None:
+            raise RuntimeError("zstd codec requires the zstandard module")
+        super().__init__(DEFAULT_ZSTD_LEVEL if level is None else level, threads)
+        # kept as bytes, so the codec can be passed to a step process
+        self.dictionary = None
+        if dictionary is not None:
+            with open(dictionary, "rb") as dictionary_file:
+                self.dictionary = dictionary_file.read()
+
+    def encode(self, reader, destination: pathlib.Path) -> int:
+        compressor = zstandard.ZstdCompressor(
+            level=self.level,
+            dict_data=(
+                zstandard.ZstdCompressionDict(self.dictionary)
+                if self.dictionary is not None
+                else None
+            ),
+            threads=self.threads if self.threads > 1 else 0,
+        )
+        with open(destination, "wb") as destination_file:
+            with compressor.stream_writer(destination_file, closefd=False) as writer:
+                return copy_stream(reader, writer)
+
+
+class Bz2Codec(Codec):
+    """Codec keeping the bzip2 files produced by netperfmeter as they are"""
+
+    name = CodecName.BZ2
+    extension = ".bz2"
+
+    def transcode(
+        self, file_path: str, keep_source: bool = False, directory: str = None
+    ) -> CodecReport:
+        report = CodecReport(file_path, file_path)
+        report.input_bytes = report.output_bytes = os.path.getsize(file_path)
+        return report
+
+
+class NoneCodec(Codec):
+    """Codec storing results uncompressed"""
+
+    name = CodecName.NONE
+    extension = ""
+
+    def encode(self, reader, destination: pathlib.Path) -> int:
+        with open(destination, "wb") as writer:
+            return copy_stream(reader, writer)
+
+
+def get_codec(
+    name: CodecName, level: int = None, threads: int = 1, dictionary: str = None
+) -> Codec:
+    """Get codec instance from name
+
+    Args:
+        name (CodecName): name of the codec
+        level (int): compression level, codec default if None
+        threads (int): number of compression threads, 0 for one per CPU
+        dictionary (str): path to a trained zstd dictionary
+
+    Returns:
+        Codec: codec instance
+    """
+    if name == CodecName.XZ:
+        return XzCodec(level, threads)
+    if name == CodecName.ZSTD:
+        return ZstdCodec(level, threads, dictionary)
+    if name == CodecName.BZ2:
+        return Bz2Codec()
+    if name == CodecName.NONE:
+        return NoneCodec()
+    raise ValueError(f"codec {name} is not within authorized values")
+
+
+def train_zstd_dictionary(
+    sample_paths: list, dictionary_path: str, size: int = DEFAULT_ZSTD_DICTIONARY_SIZE
+):
+    """Train a zstd dictionary from netperfmeter bzip2 results
+
+    Args:
+        sample_paths (list): paths to bzip2 result files used as samples
+        dictionary_path (str): path to the dictionary to write
+        size (int): size of the dictionary (in B)
+    """
+    if zstandard is None:
+        raise RuntimeError("zstd codec requires the zstandard module")
+    samples = []
+    for sample_path in sample_paths:
+        with bz2.open(sample_path, "rb") as reader:
+            # vectors are line-oriented, so split samples on lines
+            lines = []
+            length = 0
+            for line in reader:
+                lines.append(line)
+                length += len(line)
+                if length >= CHUNK_SIZE:
+                    samples.append(b"".join(lines))
+                    lines = []
+                    length = 0
+            if lines:
+                samples.append(b"".join(lines))
+    dictionary = zstandard.train_dictionary(size, samples)
+    tmp_file = f"{dictionary_path}.tmp"
+    with open(tmp_file, "wb") as dictionary_file:
+        dictionary_file.write(dictionary.as_bytes())
+    shutil.move(tmp_file, dictionary_path)
+
+
+if __name__ == "__main__":
+    # ###### Dictionary training ################################################
+    ap = argparse.ArgumentParser(description="Train a zstd dictionary for results")
+    ap.add_argument("dictionary", help="Path to the dictionary to write", type=str)
+    ap.add_argument("samples", help="bzip2 result files", type=str, nargs="+")
+    ap.add_argument(
+        "-s",
+        "--size",
+        help="Dictionary size in B",
+        type=int,
+        default=DEFAULT_ZSTD_DICTIONARY_SIZE,
+    )
+    options = ap.parse_args()
+    try:
+        train_zstd_dictionary(options.samples, options.dictionary, options.size)
+    except Exception as e:
+        sys.stderr.write(f"ERROR: Unable to train dictionary: {e}\n")
+        sys.exit(1)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Columnar Export of Netperfmeter Vectors
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+# Ubuntu/Debian dependencies:
+# python3-numpy
+
+import json
+import os
+import struct
+import tempfile
+import zipfile
+from vectors import VectorReader, numpy
+
+
+# ###### Constants ##########################################################
+# columns holding times (in s), stored as delta-encoded microseconds
+TIME_COLUMNS = {"abs_time", "rel_time"}
+# columns holding durations (in s), stored as microseconds
+DURATION_COLUMNS = {"interval"}
+# name of the member describing the encoding of the columns
+SCHEMA_MEMBER = "__schema__"
+# size of the fixed part of a zip local file header (in B)
+ZIP_LOCAL_HEADER_SIZE = 30
+# rows copied at once from a spool file into the .npz file
+SPOOL_BLOCK_ROWS = 65536
+
+
+def narrowest_integer(low: int, high: int):
+    """Get the narrowest integer type holding a range
+
+    Args:
+        low (int): smallest value, None if there is no value
+        high (int): largest value, None if there is no value
+
+    Returns:
+        numpy.dtype: narrowest integer type, int64 if there is no value
+    """
+    if low is None:
+        return numpy.dtype(numpy.int64)
+    for dtype in [
+        numpy.uint8,
+        numpy.int8,
+        numpy.uint16,
+        numpy.int16,
+        numpy.uint32,
+        numpy.int32,
+    ]:
+        info = numpy.iinfo(dtype)
+        if (info.min <= low) and (high <= info.max):
+            return numpy.dtype(dtype)
+    return numpy.dtype(numpy.int64)
+
+
+class ColumnSpool:
+    """Class encoding one column chunk by chunk into a raw spool file
+
+    Times become integer microseconds, delta-encoded from a base value stored
+    aside, durations integer microseconds, integers the narrowest integer
+    type, other numbers float32 and strings dictionary codes. Values are
+    spooled with a wide type; the narrowest one is only known at the end.
+    """
+
+    def __init__(self, name: str, dtype, directory: str):
+        """
+        Args:
+            name (str): column name
+            dtype (numpy.dtype): type of the column in the vector chunks
+            directory (str): directory for the spool file
+        """
+        self.name = name
+        self.rows = 0
+        self.low = None
+        self.high = None
+        self.base = None
+        self.last = None
+        self.values = {}
+        if name in TIME_COLUMNS:
+            self.encoding, self.dtype = "delta_us", numpy.dtype(numpy.int64)
+        elif name in DURATION_COLUMNS:
+            self.encoding, self.dtype = "us", numpy.dtype(numpy.int64)
+        elif dtype.kind == "i":
+            self.encoding, self.dtype = "int", numpy.dtype(numpy.int64)
+        elif dtype.kind == "f":
+            self.encoding, self.dtype = "float", numpy.dtype(numpy.float32)
+        else:
+            self.encoding, self.dtype = "dictionary", numpy.dtype(numpy.int64)
+        self.path = os.path.join(directory, f"{name}.raw")
+        self.file = open(self.path, "wb")
+
+    def add(self, column):
+        """Encode and spool a chunk of the column
+
+        Args:
+            column (numpy.ndarray): values of the chunk
+        """
+        if len(column) == 0:
+            return
+        if self.encoding == "delta_us":
+            microseconds = numpy.rint(column * 1e6).astype(numpy.int64)
+            if self.base is None:
+                self.base = self.last = microseconds[0]
+            encoded = numpy.diff(microseconds, prepend=self.last)
+            self.last = microseconds[-1]
+        elif self.encoding == "us":
+            encoded = numpy.rint(column * 1e6).astype(numpy.int64)
+        elif self.encoding == "dictionary":
+            values, codes = numpy.unique(column, return_inverse=True)
+            mapping = numpy.array(
+                [self.values.setdefault(value, len(self.values)) for value in values],
+                dtype=numpy.int64,
+            )
+            encoded = mapping[codes.ravel()]
+        else:
+            encoded = column.astype(self.dtype)
+        if self.dtype.kind == "i":
+            low, high = int(encoded.min()), int(encoded.max())
+            self.low = low if self.low is None else min(self.low, low)
+            self.high = high if self.high is None else max(self.high, high)
+        self.file.write(encoded.tobytes())
+        self.rows += len(encoded)
+
+    def final_dtype(self):
+        """Get the type the column is stored with
+
+        Returns:
+            numpy.dtype: narrowest integer type holding the column, or float32
+        """
+        if self.dtype.kind != "i":
+            return self.dtype
+        return narrowest_integer(self.low, self.high)
+
+    def write(self, archive):
+        """Write the column, and its base or dictionary, to the archive
+
+        The spool file is copied in blocks of SPOOL_BLOCK_ROWS rows.
+
+        Args:
+            archive (zipfile.ZipFile): archive being written
+        """
+        self.file.close()
+        dtype = self.final_dtype()
+        header = {
+            "descr": numpy.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (self.rows,),
+        }
+        with archive.open(f"{self.name}.npy", "w", force_zip64=True) as member:
+            numpy.lib.format.write_array_header_2_0(member, header)
+            with open(self.path, "rb") as spool:
+                while True:
+                    block = numpy.fromfile(spool, self.dtype, SPOOL_BLOCK_ROWS)
+                    if len(block) == 0:
+                        break
+                    member.write(block.astype(dtype).tobytes())
+        os.remove(self.path)
+        if self.encoding == "delta_us":
+            write_member(
+                archive,
+                f"{self.name}__base",
+                numpy.int64(0 if self.base is None else self.base),
+            )
+        elif self.encoding == "dictionary":
+            write_member(
+                archive, f"{self.name}__values", numpy.array(list(self.values))
+            )
+
+
+def write_member(archive, name: str, array):
+    """Write a small array to the archive as a .npy member
+
+    Args:
+        archive (zipfile.ZipFile): archive being written
+        name (str): member name, without .npy suffix
+        array (numpy.ndarray): array
+    """
+    with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+        numpy.lib.format.write_array(member, numpy.asanyarray(array))
+
+
+def export_vector(vector_path: str, npz_path: str, spool_directory: str = None) -> int:
+    """Export a vector file to an uncompressed NumPy .npz file
+
+    The vector is read in chunks and every column is encoded into a spool
+    file, so memory does not depend on the vector size. Members are stored
+    without compression, so they can be memory-mapped with map_column().
+    The file is written atomically.
+
+    Args:
+        vector_path (str): path to a plain or compressed vector file
+        npz_path (str): path to the .npz file to write
+        spool_directory (str): directory of the spool files, the one of the
+            .npz file if None
+
+    Returns:
+        int: number of rows exported
+    """
+    if numpy is None:
+        raise RuntimeError("columnar export requires the numpy module")
+    tmp_file = f"{npz_path}.tmp"
+    if spool_directory is None:
+        spool_directory = os.path.dirname(os.path.abspath(npz_path))
+    with tempfile.TemporaryDirectory(
+        prefix=".columnar-", dir=spool_directory
+    ) as spool_directory:
+        spools = None
+        for chunk in VectorReader(vector_path).iter_arrays():
+            if spools is None:
+                spools = [
+                    ColumnSpool(name, chunk.dtype[name], spool_directory)
+                    for name in chunk.dtype.names
+                ]
+            for spool in spools:
+                spool.add(chunk[spool.name])
+        if spools is None:
+            spools = [
+                ColumnSpool("abs_time", numpy.dtype(numpy.float64), spool_directory)
+            ]
+        schema = {spool.name: spool.encoding for spool in spools}
+        with zipfile.ZipFile(
+            tmp_file, "w", zipfile.ZIP_STORED, allowZip64=True
+        ) as archive:
+            for spool in spools:
+                spool.write(archive)
+            write_member(archive, SCHEMA_MEMBER, numpy.array(json.dumps(schema)))
+    os.replace(tmp_file, npz_path)
+    return spools[0].rows
+
+
+def read_columns(npz_path: str) -> dict:
+    """Read and decode the columns of an exported vector
+
+    Args:
+        npz_path (str): path to the .npz file
+
+    Returns:
+        dict: decoded array per column
+    """
+    columns = {}
+    with numpy.load(npz_path) as archive:
+        schema = json.loads(str(archive[SCHEMA_MEMBER]))
+        for name, encoding in schema.items():
+            column = archive[name]
+            if encoding == "delta_us":
+                base = archive[f"{name}__base"]
+                columns[name] = (base + numpy.cumsum(column, dtype=numpy.int64)) / 1e6
+            elif encoding == "us":
+                columns[name] = column / 1e6
+            elif encoding == "dictionary":
+                columns[name] = archive[f"{name}__values"][column]
+            else:
+                columns[name] = column
+    return columns
+
+
+def map_column(npz_path: str, name: str):
+    """Memory-map one raw (still encoded) column of an exported vector
+
+    Args:
+        npz_path (str): path to the .npz file
+        name (str): column name
+
+    Returns:
+        numpy.memmap: read-only column
+    """
+    with zipfile.ZipFile(npz_path) as archive:
+        info = archive.getinfo(f"{name}.npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"column {name} of {npz_path} is compressed")
+    with open(npz_path, "rb") as npz_file:
+        npz_file.seek(info.header_offset)
+        header = npz_file.read(ZIP_LOCAL_HEADER_SIZE)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        npz_file.seek(info.header_offset + len(header) + name_length + extra_length)
+        version = numpy.lib.format.read_magic(npz_file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(
+                npz_file
+            )
+        else:
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(
+                npz_file
+            )
+        offset = npz_file.tell()
+    return numpy.memmap(
+        npz_path,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C",
+    )
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Cycle Instrumentation for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import argparse
+import contextlib
+import json
+import logging
+import resource
+import sys
+import time
+from logsetup import log_context
+
+
+# ###### Constants ##########################################################
+# logger of the cycle events, with a handler of its own
+CYCLE_LOGGER = "cycles"
+# percentiles printed by the summary
+PERCENTILES = [50, 90, 99]
+# resource usage of the calling thread only, where the platform has it
+RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+
+
+def cpu_seconds(usage) -> float:
+    """Get CPU time of a resource usage
+
+    Args:
+        usage (resource.struct_rusage): resource usage
+
+    Returns:
+        float: user and system time (in s)
+    """
+    return usage.ru_utime + usage.ru_stime
+
+
+class CycleTimer:
+    """Class timing the phases of a measurement cycle
+
+    Each phase records its wall-clock time (monotonic), the CPU time of the
+    thread running it and of the children reaped meanwhile, and the bytes it
+    processed. The main loop and the background worker may run at the same
+    time, so CPU time is taken per thread. Children are counted per process:
+    a step process reaped during a measurement is charged to it. A cycle is
+    emitted as one JSON event on the "cycles" logger.
+    """
+
+    def __init__(self, run: str, **attributes):
+        """
+        Args:
+            run (str): run identifier
+            attributes: further attributes of the event
+        """
+        self.start = time.monotonic()
+        self.event = {"run": run, **attributes, "phases": {}}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time a phase, accumulating if the phase is entered several times
+
+        Records logged during the phase carry the run and the phase name.
+
+        Args:
+            name (str): phase name
+
+        Yields:
+            dict: record of the phase, whose "bytes" may be increased
+        """
+        record = self.event["phases"].setdefault(
+            name, {"wall": 0.0, "cpu": 0.0, "children_cpu": 0.0, "bytes": 0}
+        )
+        wall = time.monotonic()
+        usage = resource.getrusage(RUSAGE_THREAD)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            with log_context(run=self.event["run"], phase=name):
+                yield record
+        finally:
+            record["wall"] = round(record["wall"] + time.monotonic() - wall, 6)
+            record["cpu"] = round(
+                record["cpu"]
+                + cpu_seconds(resource.getrusage(RUSAGE_THREAD))
+                - cpu_seconds(usage),
+                6,
+            )
+            record["children_cpu"] = round(
+                record["children_cpu"]
+                + cpu_seconds(resource.getrusage(resource.RUSAGE_CHILDREN))
+                - cpu_seconds(children),
+                6,
+            )
+
+    def emit(self, status: str):
+        """Emit the event of the cycle
+
+        Args:
+            status (str): outcome of the cycle, e.g. "ok" or a failure class
+        """
+        self.event["status"] = status
+        self.event["wall"] = round(time.monotonic() - self.start, 6)
+        logging.getLogger(CYCLE_LOGGER).info(json.dumps(self.event))
+
+
+def percentile(values: list, p: float) -> float:
+    """Get a percentile by nearest rank
+
+    Args:
+        values (list): sorted values
+        p (float): percentile in [0, 100]
+
+    Returns:
+        float: percentile
+    """
+    rank = max(1, -(-len(values) * p // 100))
+    return values[int(rank) - 1]
+
+
+def summarize_cycles(file_paths: list) -> dict:
+    """Summarize cycle events per phase
+
+    Args:
+        file_paths (list): paths to cycle event files
+
+    Returns:
+        dict: per phase (and "cycle"), count and percentiles of every metric
+    """
+    samples = {}
+    for file_path in file_paths:
+        with open(file_path) as cycle_file:
+            for line in cycle_file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                phases = dict(event.get("phases", {}))
+                phases["cycle"] = {"wall": event.get("wall", 0.0)}
+                for name, record in phases.items():
+                    for metric, value in record.items():
+                        samples.setdefault(name, {}).setdefault(metric, []).append(
+                            value
+                        )
+    summary = {}
+    for name, metrics in samples.items():
+        summary[name] = {"count": len(metrics["wall"])}
+        for metric, values in metrics.items():
+            values.sort()
+            summary[name][metric] = {
+                f"p{p}": percentile(values, p) for p in PERCENTILES
+            }
+            summary[name][metric]["max"] = values[-1]
+    return summary
+
+
+if __name__ == "__main__":
+    # ###### Summarize cycle events #############################################
+    ap = argparse.ArgumentParser(description="Print percentiles of cycle phases")
+    ap.add_argument("files", help="Cycle event files", type=str, nargs="+")
+    options = ap.parse_args()
+    try:
+        summary = summarize_cycles(options.files)
+    except Exception as e:
+        sys.stderr.write(f"ERROR: Unable to summarize cycles: {e}\n")
+        sys.exit(1)
+    for name, metrics in sorted(summary.items()):
+        sys.stdout.write(f"{name} ({metrics['count']} cycles)\n")
+        for metric, values in metrics.items():
+            if metric != "count":
+                sys.stdout.write(
+                    f"  {metric:<12}"
+                    + "".join(f" {key}={value:<12g}" for key, value in values.items())
+                    + "\n"
+                )
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Run Journal for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import glob
+import json
+import logging
+import os
+from enum import Enum
+from publish import fsync_directory
+
+
+# ###### Constants ##########################################################
+class FileState(Enum):
+    """Class enum for the pipeline states of a result file"""
+
+    # written by netperfmeter, or by the summary or columnar export
+    PRODUCED = "produced"
+    # transcoded, or not to be transcoded, ready to publish
+    COMPRESSED = "compressed"
+    # copied to the final directory or appended to a bundle
+    PUBLISHED = "published"
+
+
+# order of the states, a run is in the earliest state of its files
+STATE_ORDER = [FileState.PRODUCED, FileState.COMPRESSED, FileState.PUBLISHED]
+
+
+class RunJournal:
+    """Class recording the result files of every run and their pipeline state
+
+    Each run has a JSON manifest, written atomically and durably on every
+    change and removed once the run is published. On startup, the runs with
+    a manifest left are the unfinished ones, so nothing has to be found by
+    scanning the staging directories.
+    """
+
+    def __init__(self, directory: str, instance: int):
+        """
+        Args:
+            directory (str): directory of the manifests
+            instance (int): measurement instance ID
+        """
+        self.directory = directory
+        self.instance = instance
+        os.makedirs(directory, 0o755, True)
+
+    def manifest_path(self, run: str) -> str:
+        """Get path of the manifest of a run
+
+        Args:
+            run (str): run time
+
+        Returns:
+            str: path to the manifest
+        """
+        return f"{self.directory}/netperfmeter_{self.instance}_run_{run}.json"
+
+    def create(self, run: str, directory: str, file_paths: list) -> dict:
+        """Record a new run
+
+        Args:
+            run (str): run time
+            directory (str): staging directory of the run
+            file_paths (list): paths to the files written by netperfmeter
+
+        Returns:
+            dict: manifest of the run
+        """
+        manifest = {"run": run, "directory": directory, "files": []}
+        for file_path in file_paths:
+            manifest["files"].append(
+                {"path": file_path, "state": FileState.PRODUCED.value}
+            )
+        self.write(manifest)
+        return manifest
+
+    def write(self, manifest: dict):
+        """Write the manifest of a run, atomically and durably
+
+        Args:
+            manifest (dict): manifest of the run
+        """
+        states = [FileState(entry["state"]) for entry in manifest["files"]]
+        manifest["state"] = min(
+            states, key=STATE_ORDER.index, default=FileState.PUBLISHED
+        ).value
+        manifest_path = self.manifest_path(manifest["run"])
+        tmp_file = f"{manifest_path}.tmp"
+        with open(tmp_file, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(tmp_file, manifest_path)
+        fsync_directory(self.directory)
+
+    def files(self, manifest: dict, state: FileState) -> list:
+        """Get the files of a run in a state
+
+        Args:
+            manifest (dict): manifest of the run
+            state (FileState): state
+
+        Returns:
+            list: paths to the files
+        """
+        return [
+            entry["path"]
+            for entry in manifest["files"]
+            if entry["state"] == state.value
+        ]
+
+    def add(self, manifest: dict, file_path: str, state: FileState):
+        """Add a file to a run, or set its state if already recorded
+
+        Args:
+            manifest (dict): manifest of the run
+            file_path (str): path to the file
+            state (FileState): state of the file
+        """
+        for entry in manifest["files"]:
+            if entry["path"] == file_path:
+                entry["state"] = state.value
+                break
+        else:
+            manifest["files"].append({"path": file_path, "state": state.value})
+        self.write(manifest)
+
+    def set_state(self, manifest: dict, file_paths: list, state: FileState):
+        """Set the state of recorded files of a run, e.g. once published
+
+        Args:
+            manifest (dict): manifest of the run
+            file_paths (list): paths to the recorded files
+            state (FileState): state of the files
+        """
+        for entry in manifest["files"]:
+            if entry["path"] in file_paths:
+                entry["state"] = state.value
+        self.write(manifest)
+
+    def replace(self, manifest: dict, file_path: str, new_path: str, state: FileState):
+        """Replace a file of a run, e.g. by its transcoded version
+
+        Args:
+            manifest (dict): manifest of the run
+            file_path (str): path to the recorded file
+            new_path (str): path to the file replacing it
+            state (FileState): state of the new file
+        """
+        for entry in manifest["files"]:
+            if entry["path"] == file_path:
+                entry["path"] = new_path
+                entry["state"] = state.value
+        self.write(manifest)
+
+    def discard(self, manifest: dict, file_path: str):
+        """Remove a file from a run, e.g. when it is deleted or lost
+
+        Args:
+            manifest (dict): manifest of the run
+            file_path (str): path to the file
+        """
+        manifest["files"] = [
+            entry for entry in manifest["files"] if entry["path"] != file_path
+        ]
+        self.write(manifest)
+
+    def finish(self, manifest: dict):
+        """Forget a published run
+
+        Args:
+            manifest (dict): manifest of the run
+        """
+        os.remove(self.manifest_path(manifest["run"]))
+
+    def pending_files(self) -> set:
+        """Get the files of the runs not published yet
+
+        Returns:
+            set: paths to the files
+        """
+        return {
+            entry["path"]
+            for manifest in self.unfinished()
+            for entry in manifest["files"]
+        }
+
+    def unfinished(self) -> list:
+        """Get the manifests of the runs not published yet
+
+        Returns:
+            list: manifests, oldest run first
+        """
+        manifests = []
+        for manifest_path in sorted(
+            glob.glob(f"{self.directory}/netperfmeter_{self.instance}_run_*.json")
+        ):
+            try:
+                with open(manifest_path) as manifest_file:
+                    manifests.append(json.load(manifest_file))
+            except (OSError, ValueError) as e:
+                logging.warning("Cannot read manifest %s: %s", manifest_path, str(e))
+        return manifests
@@ -33,13 +33,23 @@
 # Contact: hugom@simula.no
 
 
+import atexit
 import json
 import logging
 import logging.config
 import os
+import signal
 import sys
 import subprocess
+import time
 import zmq
+from logsetup import (
+    FORMATTERS_CONFIG,
+    LOG_FORMATS,
+    file_handler_config,
+    start_queue_logging,
+)
+from metrics import MetricsRegistry, SocketExporter, TextfileExporter
 
 # path to the node id file
 NODE_ID_FILE_PATH = "/nodeid"
@@ -49,6 +59,68 @@ CONFIG_FILE_PATH = "/monroe/config"
 LOG_DIRECTORY = "/monroe/results/log"
 # set if roaming is authorized for roaming
 IS_ROAMING_AUTHORIZED = False
+# optional configuration keys passed to the instances as options, boolean
+# values being passed as flags
+INSTANCE_OPTIONS = {
+    "codec": "--codec",
+    "codec_level": "--codec_level",
+    "codec_threads": "--codec_threads",
+    "zstd_dictionary": "--zstd_dictionary",
+    "interval": "--interval",
+    "schedule": "--schedule",
+    "offset": "--offset",
+    "no_summary": "--no_summary",
+    "columnar": "--columnar",
+    "no_raw_vectors": "--no_raw_vectors",
+    "bundle": "--bundle",
+    "retention_mb": "--retention_mb",
+    "retention_files": "--retention_files",
+    "retention_by_age": "--retention_by_age",
+    "min_free_mb": "--min_free_mb",
+    "staging_mb": "--staging_mb",
+    "grace": "--grace",
+    "metrics_socket_directory": "--metrics_socket_directory",
+    "log_format": "--log_format",
+    "log_ring": "--log_ring",
+    "profile": "--profile",
+}
+# path to the instance script
+INSTANCE_SCRIPT = "/opt/monroe/nne-experiment-netperfmeter/client/src/netperfmeter.py"
+# ZeroMQ topic of the modem metadata
+MODEM_TOPIC = b"MONROE.META.DEVICE.MODEM"
+# minimum time between two starts of the same instance (in s)
+MIN_RESTART_INTERVAL = 5
+# time given to an instance to stop before it is killed (in s)
+TERMINATE_TIMEOUT = 15
+# time given to all instances to stop when the launcher is stopped (in s), below
+# the 10 s Docker waits before killing every process of the container
+STOP_TIMEOUT = 8
+
+
+def read_measurement_spec(spec: dict, defaults: dict) -> dict:
+    """Read a measurement specification from the configuration
+
+    Args:
+        spec (dict): measurement entry of the configuration
+        defaults (dict): top-level configuration providing default options
+
+    Returns:
+        dict: measurement ID, MCC, MNC, optional ICCID and instance options
+    """
+    options = []
+    for key, option in INSTANCE_OPTIONS.items():
+        value = spec.get(key, defaults.get(key))
+        if (value is None) or (value is False):
+            continue
+        options += [option] if value is True else [option, str(value)]
+    return {
+        "measurement_id": int(spec["measurement_id"]),
+        "mcc": str(spec["mcc"]),
+        "mnc": str(spec["mnc"]),
+        # extra ICCID
+        "iccid": str(spec["iccid"]) if spec.get("iccid") is not None else None,
+        "options": options,
+    }
 
 
 # ====== Check node ID ======================================================
@@ -68,16 +140,16 @@ try:
 except:
     sys.stderr.write("Unable to read configuration from " + CONFIG_FILE_PATH + "!\n")
     sys.exit(1)
-# try to read basic configuration
+# try to read basic configuration, either one measurement or a list of them
 try:
-    measurement_id = configuration["measurement_id"]
-    mcc = configuration["mcc"]
-    mnc = configuration["mnc"]
-    # try to read extra ICCID
-    try:
-        iccid = configuration["iccid"]
-    except:
-        iccid = None
+    measurements = {}
+    for entry in configuration.get("measurements", [configuration]):
+        spec = read_measurement_spec(entry, configuration)
+        if spec["measurement_id"] in measurements:
+            raise ValueError(f"duplicate measurement ID {spec['measurement_id']}")
+        measurements[spec["measurement_id"]] = spec
+    if not measurements:
+        raise ValueError("no measurement")
 except Exception as e:
     sys.stderr.write(
         "Invalid or incomplete configuration in "
@@ -97,115 +169,403 @@ except:
 
 
 # ====== Initialise logger ==================================================
+log_format = configuration.get("log_format", LOG_FORMATS[0])
+if log_format not in LOG_FORMATS:
+    sys.stderr.write(f"Invalid log format {log_format} in {CONFIG_FILE_PATH}!\n")
+    sys.exit(1)
 LOGGING_CONF = {
     "version": 1,
     "handlers": {
-        "default": {
-            "level": "DEBUG",
-            "class": "logging.handlers.TimedRotatingFileHandler",
-            "formatter": "standard",
-            "filename": LOG_DIRECTORY + "/netperfmeter_launcher.log",
-            "when": "D",
-        },
-    },
-    "formatters": {
-        "standard": {
-            "format": "%(asctime)s %(levelname)s [PID=%(process)d] %(message)s"
-        },
+        "default": file_handler_config(
+            LOG_DIRECTORY + "/netperfmeter_launcher.log", log_format
+        ),
     },
+    "formatters": FORMATTERS_CONFIG,
     "root": {
         "level": "DEBUG",
         "handlers": ["default"],
     },
 }
 logging.config.dictConfig(LOGGING_CONF)
+if log_format == "json":
+    # records are written by a listener thread, off the metadata loop
+    atexit.register(start_queue_logging(logging.getLogger()).stop)
 logging.debug("Starting")
 
+
+def read_modem_metadata(payload: bytes):
+    """Read modem metadata from the JSON payload of a modem update
+
+    Args:
+        payload (bytes): JSON payload of the ZeroMQ message
+
+    Returns:
+        tuple: (InterfaceName, IMSIMCCMNC, NWMCCMNC, ICCID), None if the payload
+            is not valid
+    """
+    try:
+        metadata = json.loads(payload)
+    except Exception as e:
+        logging.warning("WARNING: Cannot read metadata: %s \n", str(e))
+        return None
+    # ------ Extract ICCID and InterfaceName ---------------------------------
+    try:
+        return (
+            metadata["InterfaceName"],
+            str(metadata["IMSIMCCMNC"]),
+            str(metadata["NWMCCMNC"]),
+            str(metadata["ICCID"]),
+        )
+    except Exception as e:
+        logging.warning("WARNING: Cannot read MONROE.META.DEVICE.MODEM: %s \n", str(e))
+        return None
+
+
+class MetadataCache:
+    """Class keeping the last relevant metadata of every modem
+
+    Only modem updates whose (InterfaceName, IMSIMCCMNC, NWMCCMNC, ICCID)
+    changed are reported. The topic is checked before decoding and payloads
+    identical to the previous one of the same topic are not decoded at all.
+    """
+
+    def __init__(self):
+        # last raw payload per topic
+        self.payloads = {}
+        # last metadata tuple per ICCID
+        self.modems = {}
+        # number of messages received, JSON decoded and reported as changed
+        self.seen = 0
+        self.parsed = 0
+        self.acted = 0
+
+    def update(self, message: bytes):
+        """Update cache from a ZeroMQ message
+
+        Args:
+            message (bytes): raw "<topic> <json>" message
+
+        Returns:
+            tuple: (InterfaceName, IMSIMCCMNC, NWMCCMNC, ICCID) if it changed,
+                None otherwise
+        """
+        self.seen += 1
+        topic, _, payload = message.partition(b" ")
+        if not (topic.startswith(MODEM_TOPIC) and topic.endswith(b".UPDATE")):
+            return None
+        if self.payloads.get(topic) == payload:
+            return None
+        self.payloads[topic] = payload
+        self.parsed += 1
+        modem = read_modem_metadata(payload)
+        if (modem is None) or (self.modems.get(modem[3]) == modem):
+            return None
+        self.modems[modem[3]] = modem
+        self.acted += 1
+        return modem
+
+    def counters(self) -> dict:
+        """Get message counters
+
+        Returns:
+            dict: numbers of messages seen, parsed and acted on
+        """
+        return {"seen": self.seen, "parsed": self.parsed, "acted": self.acted}
+
+
+def start_instance(
+    measurement_id: int, interface: str, options: list
+) -> subprocess.Popen:
+    """Start a netperfmeter instance
+
+    Args:
+        measurement_id (int): measurement instance ID
+        interface (str): name of the network interface to measure on
+        options (list): extra instance options
+
+    Returns:
+        subprocess.Popen: instance process
+    """
+    logging.debug("Starting instance %d on %s ..", measurement_id, interface)
+    cmd = [
+        INSTANCE_SCRIPT,
+        "--iface",
+        interface,
+        "-id",
+        str(measurement_id),
+    ] + options
+    # create a new process
+    process = subprocess.Popen(cmd)
+    logging.debug("Started instance %d on %s ", measurement_id, interface)
+    return process
+
+
+def stop_instances(processes: dict, timeout: float):
+    """Stop instances, killing those still running after the timeout
+
+    Args:
+        processes (dict): instance process per measurement ID
+        timeout (float): time given to all instances to stop (in s)
+    """
+    for process in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for measurement_id, process in processes.items():
+        try:
+            process.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            logging.warning(
+                "WARNING: Killing instance for measurement ID %s!\n",
+                str(measurement_id),
+            )
+            process.kill()
+            process.wait()
+
+
+def stop_handler(signum, frame):
+    """Signal handler stopping the instances, then exiting through atexit, so
+    queued log records are written"""
+    logging.info("Stopping %d instances ..", len(processes))
+    stop_instances(processes, STOP_TIMEOUT)
+    sys.exit(0)
+
+
 if __name__ == "__main__":
     # ====== Initialise ZeroMQ metadata stream ==================================
     context = zmq.Context()
     socket = context.socket(zmq.SUB)
     socket.connect("tcp://172.17.0.1:5556")
-    socket.setsockopt_string(zmq.SUBSCRIBE, "MONROE.META.DEVICE.MODEM")
+    socket.setsockopt(zmq.SUBSCRIBE, MODEM_TOPIC)
+
+    # ====== Initialise child exit notification =================================
+    # SIGCHLD writes into the wakeup pipe, which is polled with the metadata
+    wakeup_reader, wakeup_writer = os.pipe()
+    os.set_blocking(wakeup_reader, False)
+    os.set_blocking(wakeup_writer, False)
+    signal.set_wakeup_fd(wakeup_writer)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+    poller.register(wakeup_reader, zmq.POLLIN)
+
+    # ====== Export metrics =====================================================
+    metrics = MetricsRegistry()
+    metadata_messages = metrics.counter(
+        "launcher_metadata_messages", "Metadata messages received"
+    )
+    modem_changes = metrics.counter(
+        "launcher_modem_changes", "Modem metadata changes acted on"
+    )
+    instance_starts = metrics.counter(
+        "launcher_instance_starts", "Instances started, per measurement ID"
+    )
+    instance_restarts = metrics.counter(
+        "launcher_instance_restarts", "Instances restarted, per measurement ID"
+    )
+    instance_exits = metrics.counter(
+        "launcher_instance_exits",
+        "Instances that stopped unexpectedly, per measurement ID",
+    )
+    instances_running = metrics.gauge(
+        "launcher_instances_running", "Instances currently running"
+    )
+    TextfileExporter(metrics, LOG_DIRECTORY + "/netperfmeter_launcher.prom")
+    if configuration.get("metrics_socket_directory") is not None:
+        try:
+            SocketExporter(
+                metrics,
+                configuration["metrics_socket_directory"]
+                + "/netperfmeter_launcher.sock",
+            )
+        except OSError as e:
+            logging.warning("WARNING: Cannot serve metrics: %s \n", str(e))
 
     # ====== Start instances ====================================================
     processes = {}
+    # on stop, the instances publish their results before the launcher exits
+    signal.signal(signal.SIGTERM, stop_handler)
+    metadata_cache = MetadataCache()
+    # interface and start time of every instance, kept for restarts
+    interfaces = {}
+    start_times = {}
+    # kill deadline and rebind detection time of instances being rebound
+    kill_deadlines = {}
+    # instances killed after their deadline, until their exit is reaped
+    killed = set()
+    # ICCID of the modem every instance was started on
+    iccids = {}
+    rebind_times = {}
     while True:
-        topic = None
-        metadata = None
-        metadata_if = None
-        metadata_imsi_mcc_mnc = None
-        metadata_nw_mcc_mnc = None
-        metadata_iccid = None
-        metadata_mcc = None
-        metadata_mnc = None
-        # ------ Read metadata ---------------------------------------------------
-        data = socket.recv().decode("utf-8").split(" ", 1)
-        try:
-            topic = data[0]
-            metadata = json.loads(data[1])
-        except Exception as e:
-            logging.warning("WARNING: Cannot read metadata: %s \n", str(e))
-        # ------ Extract ICCID and InterfaceName ---------------------------------
-        if (topic is not None) and (metadata is not None):
-            if topic.startswith("MONROE.META.DEVICE.MODEM") and topic.endswith(
-                ".UPDATE"
-            ):
-                try:
-                    metadata_if = metadata["InterfaceName"]
-                    metadata_imsi_mcc_mnc = str(metadata["IMSIMCCMNC"])
-                    metadata_nw_mcc_mnc = str(metadata["NWMCCMNC"])
-                    metadata_iccid = str(metadata["ICCID"])
-                    metadata_mcc = metadata_imsi_mcc_mnc[0:3]
-                    metadata_mnc = metadata_imsi_mcc_mnc[3:]
-                except Exception as e:
-                    logging.warning(
-                        "WARNING: Cannot read MONROE.META.DEVICE.MODEM: %s \n", str(e)
-                    )
-        # if metadataICCID is equal to iccid
-        are_mcc_mnc_equal_to_metadata = mcc == metadata_mcc and mnc == metadata_mnc
-        is_iccid_none_or_equal_to_metadata = (iccid == metadata_iccid) or (
-            iccid is None
+        # ------ Wait for metadata, child exit or pending restart ---------------
+        timeout = None
+        for instance_id in interfaces:
+            if instance_id not in processes:
+                delay = (
+                    start_times[instance_id] + MIN_RESTART_INTERVAL - time.monotonic()
+                )
+                timeout = max(0, delay) if timeout is None else min(timeout, delay)
+        for deadline in kill_deadlines.values():
+            delay = deadline - time.monotonic()
+            timeout = max(0, delay) if timeout is None else min(timeout, delay)
+        events = dict(
+            poller.poll(None if timeout is None else max(0, int(timeout * 1000)))
         )
-        is_metadata_if_none = metadata_if is None
-        if (
-            are_mcc_mnc_equal_to_metadata
-            and is_iccid_none_or_equal_to_metadata
-            and not is_metadata_if_none
-        ):
-            # ------ Verify roaming ---------------------------------
-            is_roaming = metadata_imsi_mcc_mnc != metadata_nw_mcc_mnc
-            if is_roaming and not IS_ROAMING_AUTHORIZED:
-                logging.error(
-                    "Is roaming authorized is %s but metadata IMSI is %s and metadata network is %s !\n",
-                    str(IS_ROAMING_AUTHORIZED),
-                    str(metadata_imsi_mcc_mnc),
-                    str(metadata_nw_mcc_mnc),
+        if wakeup_reader in events:
+            try:
+                while os.read(wakeup_reader, 512):
+                    pass
+            except BlockingIOError:
+                pass
+        # ------ Supervise instances ---------------------------------------------
+        for instance_id, process in list(processes.items()):
+            # if the process has terminated
+            if process.poll() is not None:
+                # remove the process
+                del processes[instance_id]
+                was_stopped = (kill_deadlines.pop(instance_id, None) is not None) or (
+                    instance_id in killed
                 )
-                sys.exit(1)
-            # ------ Verify existing process for same measurement id --
-            # if there is an existing process with same iccid
-            if measurement_id in processes:
-                # if the process has terminated
-                if processes[measurement_id].poll() is not None:
-                    # remove the process
-                    del processes[measurement_id]
+                killed.discard(instance_id)
+                if not was_stopped:
+                    instance_exits.inc(measurement_id=instance_id)
                     logging.warning(
                         "WARNING: Instance for measurement ID %s has stopped!\n",
-                        str(measurement_id),
+                        str(instance_id),
                     )
-            # if process does not exist
-            if measurement_id not in processes:
-                logging.debug(
-                    "Starting instance %d on %s ..", measurement_id, metadata_if
+            # if the process does not stop for a rebind
+            elif time.monotonic() >= kill_deadlines.get(instance_id, float("inf")):
+                logging.warning(
+                    "WARNING: Killing instance for measurement ID %s!\n",
+                    str(instance_id),
                 )
-                cmd = [
-                    "/opt/monroe/nne-experiment-netperfmeter/client/src/netperfmeter.py",
-                    "--iface",
-                    metadata_if,
-                    "-id",
-                    str(measurement_id),
-                ]
-                # create a new process
-                processes[measurement_id] = subprocess.Popen(cmd)
-                logging.debug("Started instance %d on %s ", measurement_id, metadata_if)
+                process.kill()
+                del kill_deadlines[instance_id]
+                killed.add(instance_id)
+        for instance_id, interface in interfaces.items():
+            if (instance_id not in processes) and (
+                time.monotonic() - start_times[instance_id] >= MIN_RESTART_INTERVAL
+            ):
+                start_times[instance_id] = time.monotonic()
+                processes[instance_id] = start_instance(
+                    instance_id, interface, measurements[instance_id]["options"]
+                )
+                instance_restarts.inc(measurement_id=instance_id)
+                if instance_id in rebind_times:
+                    logging.info(
+                        "Instance %d recovered on %s in %.3f s",
+                        instance_id,
+                        interface,
+                        time.monotonic() - rebind_times.pop(instance_id),
+                    )
+        instances_running.set(len(processes))
+        if socket not in events:
+            continue
+        # ------ Read metadata ---------------------------------------------------
+        while True:
+            try:
+                message = socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            metadata_messages.inc()
+            modem = metadata_cache.update(message)
+            if modem is None:
+                continue
+            modem_changes.inc()
+            logging.debug(
+                "Modem %s changed, metadata counters %s",
+                str(modem),
+                str(metadata_cache.counters()),
+            )
+            metadata_if, metadata_imsi_mcc_mnc, metadata_nw_mcc_mnc, metadata_iccid = (
+                modem
+            )
+            metadata_mcc = metadata_imsi_mcc_mnc[0:3]
+            metadata_mnc = metadata_imsi_mcc_mnc[3:]
+            for measurement_id, spec in measurements.items():
+                # if metadataICCID is equal to iccid
+                are_mcc_mnc_equal_to_metadata = (
+                    spec["mcc"] == metadata_mcc and spec["mnc"] == metadata_mnc
+                )
+                is_iccid_none_or_equal_to_metadata = (
+                    spec["iccid"] == metadata_iccid
+                ) or (spec["iccid"] is None)
+                if not (
+                    are_mcc_mnc_equal_to_metadata and is_iccid_none_or_equal_to_metadata
+                ):
+                    continue
+                # an instance follows the modem it was started on, so two modems
+                # matching the same spec do not move it back and forth
+                if iccids.get(measurement_id, metadata_iccid) != metadata_iccid:
+                    continue
+                # ------ Verify roaming ---------------------------------
+                # other modems keep being measured, so only stop this one
+                is_roaming = metadata_imsi_mcc_mnc != metadata_nw_mcc_mnc
+                if is_roaming and not IS_ROAMING_AUTHORIZED:
+                    logging.error(
+                        "Is roaming authorized is %s but metadata IMSI is %s and metadata network is %s !\n",
+                        str(IS_ROAMING_AUTHORIZED),
+                        str(metadata_imsi_mcc_mnc),
+                        str(metadata_nw_mcc_mnc),
+                    )
+                    # out of supervision until back on the home network
+                    if measurement_id in interfaces:
+                        logging.warning(
+                            "WARNING: Stopping instance %d while roaming!\n",
+                            measurement_id,
+                        )
+                        del interfaces[measurement_id]
+                        rebind_times.pop(measurement_id, None)
+                        if (
+                            (measurement_id in processes)
+                            and (measurement_id not in kill_deadlines)
+                            and (measurement_id not in killed)
+                        ):
+                            processes[measurement_id].terminate()
+                            kill_deadlines[measurement_id] = (
+                                time.monotonic() + TERMINATE_TIMEOUT
+                            )
+                    continue
+                # ------ Rebind instance on interface change -------------
+                # the instance is stopped and restarted by the supervision
+                if (measurement_id in interfaces) and (
+                    interfaces[measurement_id] != metadata_if
+                ):
+                    logging.warning(
+                        "WARNING: Instance %d moves from %s to %s!\n",
+                        measurement_id,
+                        interfaces[measurement_id],
+                        metadata_if,
+                    )
+                    interfaces[measurement_id] = metadata_if
+                    rebind_times.setdefault(measurement_id, time.monotonic())
+                    # restart without waiting for the restart interval
+                    start_times[measurement_id] = (
+                        time.monotonic() - MIN_RESTART_INTERVAL
+                    )
+                    if (
+                        (measurement_id in processes)
+                        and (measurement_id not in kill_deadlines)
+                        and (measurement_id not in killed)
+                    ):
+                        processes[measurement_id].terminate()
+                        kill_deadlines[measurement_id] = (
+                            time.monotonic() + TERMINATE_TIMEOUT
+                        )
+                # ------ Start instance for measurement id --------------
+                # restarts of known instances are left to the supervision
+                if (measurement_id not in interfaces) and (measurement_id in processes):
+                    # still stopping after roaming, started once reaped
+                    interfaces[measurement_id] = metadata_if
+                    start_times[measurement_id] = (
+                        time.monotonic() - MIN_RESTART_INTERVAL
+                    )
+                elif measurement_id not in interfaces:
+                    interfaces[measurement_id] = metadata_if
+                    iccids[measurement_id] = metadata_iccid
+                    start_times[measurement_id] = time.monotonic()
+                    processes[measurement_id] = start_instance(
+                        measurement_id, metadata_if, spec["options"]
+                    )
+                    instance_starts.inc(measurement_id=measurement_id)
+                    instances_running.set(len(processes))
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Logging Setup for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import collections
+import contextlib
+import json
+import logging
+import logging.handlers
+import lzma
+import os
+import queue
+import shutil
+import threading
+from datetime import datetime, timezone
+
+
+# ###### Constants ##########################################################
+# available log formats
+LOG_FORMATS = ["text", "json"]
+# format of the text log lines
+TEXT_FORMAT = "%(asctime)s %(levelname)s [PID=%(process)d] %(message)s"
+# size at which a JSON log is rotated (in bytes)
+JSON_LOG_SIZE = 4 * 1024 * 1024
+# number of rotated JSON logs kept, compressed
+JSON_LOG_BACKUPS = 10
+# formatters of the main log handler, for logging.config
+FORMATTERS_CONFIG = {
+    "standard": {"format": TEXT_FORMAT},
+    "json": {"()": "logsetup.JSONFormatter"},
+}
+# number of debug records kept in memory by default, 0 to write them all
+LOG_RING_RECORDS = 1000
+# extra of a record dumping the debug records kept in memory, e.g. on failure
+DUMP_EXTRA = {"dump_log_ring": True}
+# context fields added to every JSON record
+CONTEXT_FIELDS = ["instance", "run", "phase"]
+# context fields of the process, and of the current thread
+PROCESS_CONTEXT = {}
+THREAD_CONTEXT = threading.local()
+
+
+def set_log_context(**fields):
+    """Set context fields of every record of the process, e.g. the instance
+
+    Args:
+        fields: context fields
+    """
+    PROCESS_CONTEXT.update(fields)
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """Set context fields of the records of the current thread, e.g. the run
+
+    Args:
+        fields: context fields, restored on exit
+    """
+    previous = getattr(THREAD_CONTEXT, "fields", {})
+    THREAD_CONTEXT.fields = {**previous, **fields}
+    try:
+        yield
+    finally:
+        THREAD_CONTEXT.fields = previous
+
+
+class ContextFilter(logging.Filter):
+    """Filter adding the context fields to records, in the emitting thread
+
+    Fields given with extra= are kept.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = {**PROCESS_CONTEXT, **getattr(THREAD_CONTEXT, "fields", {})}
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Class formatting records as JSON lines"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        for field in CONTEXT_FIELDS:
+            event[field] = getattr(record, field, None)
+        event["message"] = record.getMessage().rstrip("\n")
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            event["exception"] = record.exc_text
+        return json.dumps(event, default=str)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Class queuing records with their context fields to a listener thread
+
+    Unlike QueueHandler, the message is merged without formatting, so the
+    listener handlers format the record and its exception as they like.
+    """
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.addFilter(ContextFilter())
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Class rotating a log by size, compressing rotated logs with xz
+
+    Rotation happens in the thread emitting the record, i.e. the listener
+    thread when queued.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = lambda name: name + ".xz"
+        self.rotator = self.compress
+
+    @staticmethod
+    def compress(source: str, destination: str):
+        """Compress a rotated log
+
+        Args:
+            source (str): path to the log being rotated
+            destination (str): path to the compressed log
+        """
+        with open(source, "rb") as source_file:
+            with lzma.open(destination + ".tmp", "wb") as destination_file:
+                shutil.copyfileobj(source_file, destination_file)
+        os.replace(destination + ".tmp", destination)
+        os.remove(source)
+
+
+class RingBufferHandler(logging.Handler):
+    """Class keeping debug records in memory, writing them only on failure
+
+    Records at or above the pass level go to the target handler right away.
+    Records below are kept in a ring buffer of the last ones, written to the
+    target handler before an error record or a record with DUMP_EXTRA.
+    """
+
+    def __init__(
+        self,
+        target: logging.Handler,
+        capacity: int = LOG_RING_RECORDS,
+        pass_level: int = logging.INFO,
+        dump_level: int = logging.ERROR,
+    ):
+        """
+        Args:
+            target (logging.Handler): handler writing the records
+            capacity (int): number of records kept in memory
+            pass_level (int): level from which records are written right away
+            dump_level (int): level from which the kept records are written
+        """
+        super().__init__()
+        self.target = target
+        self.pass_level = pass_level
+        self.dump_level = dump_level
+        self.buffer = collections.deque(maxlen=capacity)
+        self.dropped = 0
+
+    def emit(self, record: logging.LogRecord):
+        if record.levelno < self.pass_level:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            # arguments may change before the record is written
+            record.msg = record.getMessage()
+            record.args = None
+            self.buffer.append(record)
+            return
+        if (record.levelno >= self.dump_level) or getattr(
+            record, "dump_log_ring", False
+        ):
+            self.dump(record)
+        self.target.handle(record)
+
+    def dump(self, cause: logging.LogRecord):
+        """Write the records kept in memory to the target handler
+
+        Args:
+            cause (logging.LogRecord): record causing the dump, giving context
+        """
+        if not self.buffer:
+            return
+        self.target.handle(
+            logging.makeLogRecord(
+                {
+                    **cause.__dict__,
+                    "msg": "Dumping %d debug records kept in memory (%d dropped before)",
+                    "args": (len(self.buffer), self.dropped),
+                    "levelno": logging.INFO,
+                    "levelname": "INFO",
+                    "exc_info": None,
+                    "exc_text": None,
+                }
+            )
+        )
+        while self.buffer:
+            self.target.handle(self.buffer.popleft())
+        self.dropped = 0
+        self.target.flush()
+
+    def flush(self):
+        self.target.flush()
+
+    def close(self):
+        self.target.close()
+        super().close()
+
+
+def start_ring_buffer(logger: logging.Logger, capacity: int):
+    """Put the handlers of a logger behind ring buffers of debug records
+
+    Args:
+        logger (logging.Logger): logger, e.g. the root logger
+        capacity (int): number of debug records kept in memory per handler
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        logger.addHandler(RingBufferHandler(handler, capacity))
+
+
+def file_handler_config(file_path: str, log_format: str) -> dict:
+    """Get configuration of the main log handler, for logging.config
+
+    The configuration refers to the "standard" and "json" formatters of
+    FORMATTERS_CONFIG.
+
+    Args:
+        file_path (str): path to the log, ".log" being ".jsonl" in JSON
+        log_format (str): log format, in LOG_FORMATS
+
+    Returns:
+        dict: handler configuration
+    """
+    if log_format == "json":
+        return {
+            "level": "DEBUG",
+            "class": "logsetup.CompressingRotatingFileHandler",
+            "formatter": "json",
+            "filename": os.path.splitext(file_path)[0] + ".jsonl",
+            "maxBytes": JSON_LOG_SIZE,
+            "backupCount": JSON_LOG_BACKUPS,
+        }
+    return {
+        "level": "DEBUG",
+        "class": "logging.handlers.TimedRotatingFileHandler",
+        "formatter": "standard",
+        "filename": file_path,
+        "when": "D",
+    }
+
+
+def start_queue_logging(logger: logging.Logger) -> logging.handlers.QueueListener:
+    """Move the handlers of a logger behind a queue and a listener thread
+
+    Logging then never waits for file writes, rotation or compression.
+
+    Args:
+        logger (logging.Logger): logger, e.g. the root logger
+
+    Returns:
+        logging.handlers.QueueListener: started listener, to stop at exit
+    """
+    record_queue = queue.SimpleQueue()
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(ContextQueueHandler(record_queue))
+    listener = logging.handlers.QueueListener(
+        record_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    return listener
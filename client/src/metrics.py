@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# OpenMetrics Exporter for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import logging
+import os
+import socket
+import threading
+
+
+# ###### Constants ##########################################################
+# minimum time between two writes of a textfile (in s)
+DEFAULT_WRITE_INTERVAL = 10.0
+# default histogram buckets
+DEFAULT_BUCKETS = [0.01, 0.1, 1.0, 10.0, 100.0]
+
+
+def format_labels(labels: dict) -> str:
+    """Format labels of a sample
+
+    Args:
+        labels (dict): label values per name
+
+    Returns:
+        str: labels as {name="value",...}, empty if there is none
+    """
+    if not labels:
+        return ""
+    escaped = {
+        name: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for name, value in labels.items()
+    }
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def format_value(value: float) -> str:
+    """Format a sample value
+
+    Args:
+        value (float): value
+
+    Returns:
+        str: value, as integer when integral
+    """
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class for metric families"""
+
+    type = "unknown"
+
+    def __init__(self, registry, name: str, help: str):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        # state per label set, as a tuple of (name, value) pairs
+        self.values = {}
+
+    def samples(self) -> list:
+        """Get the samples of the family
+
+        Returns:
+            list: (sample name, labels, value) of every sample
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Render the family in the OpenMetrics text format
+
+        Returns:
+            str: family lines
+        """
+        lines = [f"# TYPE {self.name} {self.type}", f"# HELP {self.name} {self.help}"]
+        for name, labels, value in self.samples():
+            labels = {**self.registry.labels, **labels}
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """Class for counters, monotonically increasing"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Increase the counter
+
+        Args:
+            amount (float): increment, not negative
+            labels: label values
+        """
+        key = tuple(sorted(labels.items()))
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.changed.set()
+
+    def samples(self) -> list:
+        return [
+            (f"{self.name}_total", dict(key), value)
+            for key, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    """Class for gauges, set to the current value"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        """Set the gauge
+
+        Args:
+            value (float): value
+            labels: label values
+        """
+        key = tuple(sorted(labels.items()))
+        with self.registry.lock:
+            if self.values.get(key) == value:
+                return
+            self.values[key] = value
+        self.registry.changed.set()
+
+    def samples(self) -> list:
+        return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    """Class for histograms, counting observations per bucket"""
+
+    type = "histogram"
+
+    def __init__(self, registry, name: str, help: str, buckets: list):
+        super().__init__(registry, name, help)
+        self.buckets = sorted(buckets) + [float("inf")]
+
+    def observe(self, value: float, **labels):
+        """Record an observation
+
+        Args:
+            value (float): observed value
+            labels: label values
+        """
+        key = tuple(sorted(labels.items()))
+        with self.registry.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[key] = (counts, total + value)
+        self.registry.changed.set()
+
+    def samples(self) -> list:
+        samples = []
+        for key, (counts, total) in self.values.items():
+            labels = dict(key)
+            for bound, count in zip(self.buckets, counts):
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        {**labels, "le": format_value(bound)},
+                        count,
+                    )
+                )
+            samples.append((f"{self.name}_count", labels, counts[-1]))
+            samples.append((f"{self.name}_sum", labels, total))
+        return samples
+
+
+class MetricsRegistry:
+    """Class holding the metric families of a process
+
+    Updates only change values in memory; rendering is done by the exporters,
+    only when the metrics changed or are read.
+    """
+
+    def __init__(self, **labels):
+        """
+        Args:
+            labels: labels added to every sample, e.g. instance="1"
+        """
+        self.labels = labels
+        self.metrics = []
+        self.lock = threading.Lock()
+        # set on every update
+        self.changed = threading.Event()
+
+    def _add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        """Add a counter
+
+        Args:
+            name (str): family name, without the _total suffix
+            help (str): description
+
+        Returns:
+            Counter: counter
+        """
+        return self._add(Counter(self, name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        """Add a gauge
+
+        Args:
+            name (str): family name
+            help (str): description
+
+        Returns:
+            Gauge: gauge
+        """
+        return self._add(Gauge(self, name, help))
+
+    def histogram(
+        self, name: str, help: str, buckets: list = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """Add a histogram
+
+        Args:
+            name (str): family name
+            help (str): description
+            buckets (list): upper bounds of the buckets, +Inf being added
+
+        Returns:
+            Histogram: histogram
+        """
+        return self._add(Histogram(self, name, help, buckets))
+
+    def render(self) -> str:
+        """Render every family in the OpenMetrics text format
+
+        Returns:
+            str: exposition, ended by "# EOF"
+        """
+        with self.lock:
+            return "".join(metric.render() for metric in self.metrics) + "# EOF\n"
+
+
+class TextfileExporter:
+    """Class writing the metrics to a textfile when they change
+
+    A background thread sleeps until the metrics change, writes them
+    atomically, then waits at least the write interval before the next write.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        file_path: str,
+        interval: float = DEFAULT_WRITE_INTERVAL,
+    ):
+        """
+        Args:
+            registry (MetricsRegistry): metrics to write
+            file_path (str): path to the textfile
+            interval (float): minimum time between two writes (in s)
+        """
+        self.registry = registry
+        self.file_path = file_path
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self.thread.start()
+
+    def write(self):
+        """Write the metrics now"""
+        self.registry.changed.clear()
+        tmp_file = f"{self.file_path}.tmp"
+        try:
+            with open(tmp_file, "w") as metrics_file:
+                metrics_file.write(self.registry.render())
+            os.replace(tmp_file, self.file_path)
+        except OSError as e:
+            logging.debug("Cannot write metrics: %s", str(e))
+
+    def _run(self):
+        while not self.stopping.is_set():
+            self.registry.changed.wait()
+            if self.stopping.is_set():
+                return
+            self.write()
+            self.stopping.wait(self.interval)
+
+    def close(self):
+        """Stop the thread and write the last metrics"""
+        self.stopping.set()
+        self.registry.changed.set()
+        self.thread.join()
+        self.write()
+
+
+class SocketExporter:
+    """Class serving the metrics on a unix socket
+
+    Every connection gets the current metrics, then is closed, e.g. with
+    "socat - UNIX-CONNECT:<path>". Nothing is rendered when nobody connects.
+    """
+
+    def __init__(self, registry: MetricsRegistry, socket_path: str):
+        """
+        Args:
+            registry (MetricsRegistry): metrics to serve
+            socket_path (str): path to the unix socket, replaced if it exists
+        """
+        self.registry = registry
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(socket_path)
+        self.server.listen()
+        self.thread = threading.Thread(
+            target=self._run, name="metrics-socket", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            with connection:
+                try:
+                    connection.settimeout(1.0)
+                    connection.sendall(self.registry.render().encode("utf-8"))
+                except OSError:
+                    pass
+
+    def close(self):
+        """Stop serving and remove the socket"""
+        self.server.close()
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
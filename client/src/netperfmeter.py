@@ -37,20 +37,53 @@
 # python3-netifaces python3-zmq
 
 import argparse
+import json
 import subprocess
 import logging
 import logging.config
 import os
 import signal
 import sys
+import threading
 import time
-import glob
-import netifaces
-import shutil
-import pathlib
-from datetime import datetime
+import functools
+from datetime import datetime, timezone
 from ipaddress import ip_address
 from enum import Enum
+from addrmonitor import AddressMonitor
+from bundle import DailyBundler
+from columnar import export_vector
+from codec import (
+    CODEC_LOGGER,
+    Bz2Codec,
+    CodecName,
+    CorruptSourceError,
+    get_codec,
+    summarize_reports,
+)
+from instrumentation import CYCLE_LOGGER, CycleTimer
+from journal import FileState, RunJournal
+from logsetup import (
+    DUMP_EXTRA,
+    FORMATTERS_CONFIG,
+    LOG_FORMATS,
+    LOG_RING_RECORDS,
+    file_handler_config,
+    log_context,
+    set_log_context,
+    start_queue_logging,
+    start_ring_buffer,
+)
+from metrics import MetricsRegistry, SocketExporter, TextfileExporter
+from progress import ProgressMonitor, stream_output
+from publish import DirectorySyncer, publish_file
+from retention import RetentionManager
+from retry import ClassifiedError, FailureClass, RetryPolicy
+from staging import StagingArea
+from scheduler import CronScheduler, IntervalScheduler, node_offset
+from summary import summarize_run, write_summary
+from traffic import load_profile
+from worker import BackgroundWorker
 
 
 # ###### Constants ##########################################################
@@ -64,14 +97,24 @@ class TransportProtocol(Enum):
     DCCP = "dccp"
 
 
-# Waiting time before restarting on error (in s)
-SLEEP_ON_ERROR = 300
+# Waiting time for netperfmeter to stop on shutdown before killing it (in s)
+SHUTDOWN_TIMEOUT = 5
+# Time after the shutdown request from which queued runs are left to the
+# journal (in s), so the instance exits within the 8 s the launcher gives on a
+# container stop (STOP_TIMEOUT in launcher.py), itself below the 10 s of Docker
+SHUTDOWN_DRAIN_DEADLINE = 6
+# Waiting time for a background step to end before measuring alongside it (in s)
+STEP_TIMEOUT = 10
+# Waiting time for the interface to get an address at the start of a run (in s)
+INTERFACE_TIMEOUT = 10
 # default netperfmeter destination
 DEFAULT_DADDR = ip_address("185.196.88.34")
 # default destination port
 DEFAULT_DPORT = 15211
 # default running time
 DEFAULT_TIME = 5
+# time given to netperfmeter beyond the running time before stopping it (in s)
+DEFAULT_GRACE = 30
 # netperfmeter specification for traffic
 DEFAULT_OUTGOING_FRAME_RATE = 30
 DEFAULT_OUTGOING_FRAME_SIZE = 166666
@@ -80,60 +123,320 @@ DEFAULT_INCOMING_FRAME_SIZE = 0
 DEFAULT_TRANSPORT = TransportProtocol.UDP
 # number of minutes to interval two measurements
 DEFAULT_INTERVAL = 60 * 6
+# spread of the per-node offsets of the runs within a slot (in s)
+DEFAULT_OFFSET_SPREAD = 60 * 10
 # file path constants
 NODEID_FILE = "/nodeid"
 LOG_DIRECTORY = "/monroe/results/log"
 FINAL_RESULT_DIRECTORY = "/monroe/results"
 TMP_RESULT_DIRECTORY = "/tmp/results"
+# derived files, on the file system of the final directory to be published by
+# a rename, so they are written to flash once
+DERIVED_DIRECTORY = "/monroe/results/.derived"
+STAGING_DIRECTORY = "/dev/shm/results"
+BUNDLE_DIRECTORY = "/monroe/results/.bundles"
+JOURNAL_DIRECTORY = "/monroe/results/.journal"
 NETPERFMETER_BINARY = "/opt/netperfmeter"
-XZ_BINARY = "/usr/bin/xz"
+# default result codec
+DEFAULT_CODEC = CodecName.XZ
+# size (in B) and number of the rotated cycle event and codec report files
+CYCLE_LOG_SIZE = 1024 * 1024
+CYCLE_LOG_BACKUPS = 5
+# free space below which measurements pause (in MiB)
+DEFAULT_MIN_FREE_MB = 64
+# budget of the raw results staged in memory (in MiB)
+DEFAULT_STAGING_MB = 256
 
 
 # ###### Global variables ###################################################
-RUNNING = True
-COMPRESS = True
+# set on SIGINT/SIGTERM, waking up any wait of the main loop
+SHUTDOWN = threading.Event()
+SHUTDOWN_TIME = None
+# running netperfmeter process, if any
+NETPERFMETER_PROCESS = None
+# background worker post-processing the runs
+WORKER = None
+# metrics of the instance, labelled with the instance ID once known
+METRICS = MetricsRegistry()
+RUNS_STARTED = METRICS.counter("netperfmeter_runs_started", "Measurement runs started")
+RUNS_SUCCEEDED = METRICS.counter(
+    "netperfmeter_runs_succeeded", "Measurement cycles that succeeded"
+)
+RUNS_FAILED = METRICS.counter(
+    "netperfmeter_runs_failed", "Measurement cycles that failed, per failure class"
+)
+RUN_DURATION = METRICS.histogram(
+    "netperfmeter_run_duration_seconds",
+    "Duration of the netperfmeter runs",
+    [1, 5, 10, 30, 60, 120],
+)
+COMPRESSION_RATIO = METRICS.histogram(
+    "netperfmeter_compression_ratio",
+    "Compression ratio of the transcoded runs",
+    [1, 2, 5, 10, 20, 50],
+)
+PUBLISHED_BYTES = METRICS.counter(
+    "netperfmeter_published_bytes", "Bytes published to the result directory"
+)
+PUBLISHED_FILES = METRICS.counter(
+    "netperfmeter_published_files", "Files published to the result directory"
+)
+MEASURING = METRICS.gauge("netperfmeter_measuring", "1 while netperfmeter is running")
+QUEUE_DEPTH = METRICS.gauge(
+    "netperfmeter_queue_depth", "Runs waiting for post-processing"
+)
+RESULT_BYTES = METRICS.gauge(
+    "netperfmeter_result_bytes", "Bytes of the result files under retention"
+)
+FREE_BYTES = METRICS.gauge(
+    "netperfmeter_free_bytes", "Free bytes of the fullest result file system"
+)
+LAST_SUCCESS = METRICS.gauge(
+    "netperfmeter_last_success_timestamp_seconds",
+    "Time of the last successful measurement cycle",
+)
 
 
 def signal_handler(signum, frame):
     """Signal handler catching signal"""
-    global RUNNING
-    RUNNING = False
+    global SHUTDOWN_TIME
+    if SHUTDOWN.is_set():
+        return
+    SHUTDOWN_TIME = time.monotonic()
+    SHUTDOWN.set()
+    process = NETPERFMETER_PROCESS
+    if (process is not None) and (process.poll() is None):
+        # netperfmeter stops its flows and writes its results on SIGINT
+        process.send_signal(signal.SIGINT)
+        killer = threading.Timer(SHUTDOWN_TIMEOUT, process.kill)
+        killer.daemon = True
+        killer.start()
 
 
-def get_network_interface_ip_address(name: str, ip_version: int = 4) -> ip_address:
-    """Get network interface IP address from name
+def read_node_id() -> int:
+    """Read node ID from the node ID file
+
+    Returns:
+        int: node ID, 0 if the file cannot be read
+    """
+    try:
+        with open(NODEID_FILE) as node_id_file:
+            return int(node_id_file.read())
+    except Exception:
+        return 0
+
+
+def publish_past_bundles(bundler: DailyBundler, day: str, syncer: DirectorySyncer):
+    """Seal and publish the bundles of the days before a day
 
     Args:
-        name (str): name of the network interface
-        ip_version (int): IP version in [4, 6]
+        bundler (DailyBundler): bundler of the results
+        day (str): current day as YYYY-MM-DD
+        syncer (DirectorySyncer): syncer of the final directory
+    """
+    for past_day in bundler.past_days(day):
+        for file_path in bundler.seal(past_day):
+            publish_file(file_path, FINAL_RESULT_DIRECTORY, syncer=syncer)
 
-    Returns:
-        ip_address: IP address of the network interface
+
+def post_process_job(job: dict, **kwargs):
+    """Post-process a queued run and emit its cycle event
+
+    Args:
+        job (dict): journal manifest ("manifest") and timer ("timer") of the run,
+            or day before which bundles are published ("seal")
+        kwargs: further arguments of post_process_run()
     """
-    if ip_version not in [4, 6]:
-        raise ValueError(
-            f"ip_version {ip_version} is not within authorized values [4, 6]"
+    if "seal" in job:
+        syncer = DirectorySyncer()
+        try:
+            with WORKER.step():
+                publish_past_bundles(kwargs["bundler"], job["seal"], syncer)
+                syncer.sync()
+        except Exception as e:
+            raise ClassifiedError(FailureClass.PUBLISH, e) from e
+        return
+    status = "ok"
+    try:
+        with log_context(run=job["manifest"]["run"]):
+            post_process_run(job["manifest"], job["timer"], **kwargs)
+    except Exception as e:
+        status = getattr(e, "failure_class", FailureClass.OTHER).value
+        RUNS_FAILED.inc(failure_class=status)
+        raise
+    finally:
+        job["timer"].emit(status)
+        # a retry is timed as a cycle of its own
+        job["timer"] = CycleTimer(
+            job["manifest"]["run"], instance=kwargs["options"].instance, retry=True
         )
-    af = netifaces.AF_INET if ip_version == 4 else netifaces.AF_INET6
-    return ip_address(netifaces.ifaddresses(name)[af][0]["addr"])
+        QUEUE_DEPTH.set(WORKER.counters()["queued"])
+
 
+def post_process_run(
+    manifest: dict, timer: CycleTimer, options, codec, bundler, journal
+):
+    """Summarize, transcode and publish the results of a run
 
-def safe_copy_file_to_dir(file_path: str, directory: str, keep_source: bool = False):
-    """Safely copy file to directory from file path
+    Every step waits for the end of any running measurement and records its
+    outcome in the journal, so an interrupted run resumes where it stopped.
 
     Args:
-        tmp_res_file_path (str): path to the temporary file
+        manifest (dict): journal manifest of the run
+        timer (CycleTimer): timer of the phases of the run
+        options (argparse.Namespace): instance options
+        codec (Codec): codec for results
+        bundler (DailyBundler): bundler of the results, None to publish files
+        journal (RunJournal): journal of the runs
     """
-    # retrieve file path
-    source = pathlib.Path(file_path)
-    destination_path = f"{pathlib.Path(directory)}/{source.name}"
-    tmp_file = f"{destination_path}.tmp"
-    # copy file to final result directory with .tmp
-    shutil.copy2(source, tmp_file)
-    # change file name removing tmp
-    shutil.move(tmp_file, destination_path)
-    if not keep_source:
-        os.remove(source)
+    run = manifest["run"]
+    directory = DERIVED_DIRECTORY
+    # files lost in a crash, e.g. staged in memory, are dropped
+    for file_path in journal.files(manifest, FileState.PRODUCED) + journal.files(
+        manifest, FileState.COMPRESSED
+    ):
+        if not os.path.exists(file_path):
+            logging.warning("Result file %s of run %s is lost", file_path, run)
+            journal.discard(manifest, file_path)
+    vector_paths = [
+        path
+        for path in journal.files(manifest, FileState.PRODUCED)
+        if "_vector_" in path
+    ]
+    scalar_paths = [
+        path
+        for path in journal.files(manifest, FileState.PRODUCED)
+        if "_scalar_" in path
+    ]
+    # ----- Summarize run ------------------------------------------------
+    # on shutdown, summary and columnar export are skipped to stop quickly
+    if (
+        (not options.no_summary)
+        and (vector_paths or scalar_paths)
+        and not SHUTDOWN.is_set()
+    ):
+        try:
+            with WORKER.step(), timer.phase("summary") as record:
+                record["bytes"] += sum(
+                    os.path.getsize(path) for path in vector_paths + scalar_paths
+                )
+                summary = WORKER.call(summarize_run, vector_paths, scalar_paths)
+                summary.update(
+                    {
+                        "run": run,
+                        "instance": options.instance,
+                        "iface": options.iface,
+                    }
+                )
+                summary_path = (
+                    f"{directory}/netperfmeter_{options.instance}_summary_{run}.json"
+                )
+                write_summary(summary, summary_path)
+            # the summary is published as it is
+            journal.add(manifest, summary_path, FileState.COMPRESSED)
+        except Exception as e:
+            # the raw results are still published
+            logging.warning("Cannot summarize run: %s", str(e))
+    # ----- Export vectors to columnar files -----------------------------
+    if options.columnar and not SHUTDOWN.is_set():
+        for file_path in vector_paths:
+            npz_path = os.path.join(
+                directory, os.path.basename(file_path).removesuffix(".vec.bz2") + ".npz"
+            )
+            try:
+                with WORKER.step(), timer.phase("columnar") as record:
+                    record["bytes"] += os.path.getsize(file_path)
+                    # the spool files go with the raw vector, e.g. in memory
+                    rows = WORKER.call(
+                        export_vector,
+                        file_path,
+                        npz_path,
+                        os.path.dirname(file_path),
+                    )
+            except Exception as e:
+                # the raw vector is still published
+                logging.warning("Cannot export %s: %s", file_path, str(e))
+                continue
+            logging.debug("Exported %d rows to %s", rows, npz_path)
+            journal.add(manifest, npz_path, FileState.COMPRESSED)
+            if options.no_raw_vectors:
+                os.remove(file_path)
+                journal.discard(manifest, file_path)
+    # ----- Transcode data -----------------------------------------------
+    reports = []
+    active_codec = codec
+    for file_path in journal.files(manifest, FileState.PRODUCED):
+        with WORKER.step(), timer.phase("transcode") as record:
+            # on shutdown, bzip2 results are published as they are to stop quickly
+            if SHUTDOWN.is_set():
+                active_codec = Bz2Codec()
+            # stream bzip2 data through the codec
+            try:
+                if active_codec.name == CodecName.BZ2:
+                    # keeping the file as it is needs no step process
+                    report = active_codec.transcode(file_path, keep_source=True)
+                else:
+                    report = WORKER.call(
+                        active_codec.transcode, file_path, True, directory
+                    )
+            except CorruptSourceError as e:
+                # a truncated file fails again on every retry, e.g. when
+                # netperfmeter was killed, so it is published as it is
+                logging.warning("Publishing %s as it is: %s", file_path, str(e))
+                report = Bz2Codec().transcode(file_path)
+            except Exception as e:
+                raise ClassifiedError(FailureClass.COMPRESSION, e) from e
+            record["bytes"] += report.input_bytes
+        reports.append(report)
+        # the source is removed only once the journal points at the produced
+        # file, so a crash in between transcodes it again on resume
+        journal.replace(manifest, file_path, report.destination, FileState.COMPRESSED)
+        if report.destination != file_path:
+            os.remove(file_path)
+    # ----- Report codec cost and gain ----------------------------------
+    if reports:
+        codec_report = summarize_reports(reports)
+        codec_report.update(
+            {
+                "run": run,
+                "codec": active_codec.name.value,
+                "level": active_codec.level,
+                "threads": active_codec.threads,
+                "queue": WORKER.counters(),
+            }
+        )
+        logging.info("Codec report %s", json.dumps(codec_report))
+        if codec_report["raw_bytes"]:
+            COMPRESSION_RATIO.observe(codec_report["ratio"])
+        logging.getLogger(CODEC_LOGGER).info(json.dumps(codec_report))
+    # ----- Copy compress data to directory  --------------------------------
+    run_paths = journal.files(manifest, FileState.COMPRESSED)
+    # the final directory is flushed once for all published files
+    syncer = DirectorySyncer()
+    try:
+        with WORKER.step(), timer.phase("publish") as record:
+            published_bytes = sum(os.path.getsize(path) for path in run_paths)
+            record["bytes"] += published_bytes
+            if bundler is not None:
+                day = run[:10]
+                # publish the bundles of the previous days
+                publish_past_bundles(bundler, day, syncer)
+                bundler.append(run, run_paths, day)
+                journal.set_state(manifest, run_paths, FileState.PUBLISHED)
+                for file_path in run_paths:
+                    os.remove(file_path)
+            else:
+                # for every transcoded file and summary
+                for file_path in run_paths:
+                    # rename or copy durably to final directory
+                    publish_file(file_path, FINAL_RESULT_DIRECTORY, syncer=syncer)
+                    journal.set_state(manifest, [file_path], FileState.PUBLISHED)
+            syncer.sync()
+    except Exception as e:
+        raise ClassifiedError(FailureClass.PUBLISH, e) from e
+    journal.finish(manifest)
+    PUBLISHED_BYTES.inc(published_bytes)
+    PUBLISHED_FILES.inc(len(run_paths))
 
 
 if __name__ == "__main__":
@@ -166,10 +469,24 @@ if __name__ == "__main__":
     ap.add_argument(
         "-i",
         "--interval",
-        help="Time in minute for sleeping interval",
+        help="Time in minute between two wall-clock aligned runs",
         type=int,
         default=DEFAULT_INTERVAL,
     )
+    ap.add_argument(
+        "-s",
+        "--schedule",
+        help="Cron expression in UTC for runs, overriding the interval",
+        type=str,
+        default=None,
+    )
+    ap.add_argument(
+        "-o",
+        "--offset",
+        help="Time in seconds of the runs after the slots, derived from node ID if unset",
+        type=int,
+        default=None,
+    )
     ap.add_argument(
         "-id",
         "--instance",
@@ -191,6 +508,13 @@ if __name__ == "__main__":
         type=int,
         default=DEFAULT_TIME,
     )
+    ap.add_argument(
+        "-g",
+        "--grace",
+        help="Time in seconds after the running time before stopping a hanging run",
+        type=int,
+        default=DEFAULT_GRACE,
+    )
     ap.add_argument(
         "-tp",
         "--transport_protocol",
@@ -216,10 +540,131 @@ if __name__ == "__main__":
     ap.add_argument(
         "-u",
         "--uncompressed",
-        help="Turn off results compression",
+        help="Keep netperfmeter bzip2 results (same as --codec bz2)",
+        action="store_true",
+        default=False,
+    )
+    ap.add_argument(
+        "-ns",
+        "--no_summary",
+        help="Turn off run summary",
+        action="store_true",
+        default=False,
+    )
+    ap.add_argument(
+        "-cv",
+        "--columnar",
+        help="Export vectors to columnar NumPy .npz files",
+        action="store_true",
+        default=False,
+    )
+    ap.add_argument(
+        "-nr",
+        "--no_raw_vectors",
+        help="Drop raw vectors once exported to columnar files",
         action="store_true",
         default=False,
     )
+    ap.add_argument(
+        "-b",
+        "--bundle",
+        help="Append results to one archive per day instead of separate files",
+        action="store_true",
+        default=False,
+    )
+    ap.add_argument(
+        "-rm",
+        "--retention_mb",
+        help="Budget in MiB of the result files, 0 for no budget",
+        type=int,
+        default=0,
+    )
+    ap.add_argument(
+        "-rf",
+        "--retention_files",
+        help="Budget in files of the result files, 0 for no budget",
+        type=int,
+        default=0,
+    )
+    ap.add_argument(
+        "-ra",
+        "--retention_by_age",
+        help="Evict the oldest result files first instead of raw vectors first",
+        action="store_true",
+        default=False,
+    )
+    ap.add_argument(
+        "-mf",
+        "--min_free_mb",
+        help="Free space in MiB below which measurements pause",
+        type=int,
+        default=DEFAULT_MIN_FREE_MB,
+    )
+    ap.add_argument(
+        "-sm",
+        "--staging_mb",
+        help="Budget in MiB of the raw results staged in memory, 0 to stage on disk",
+        type=int,
+        default=DEFAULT_STAGING_MB,
+    )
+    ap.add_argument(
+        "-ms",
+        "--metrics_socket_directory",
+        help="Directory of the unix socket serving metrics, no socket if unset",
+        type=str,
+        default=None,
+    )
+    ap.add_argument(
+        "-c",
+        "--codec",
+        help="Codec for results",
+        type=CodecName,
+        default=DEFAULT_CODEC,
+        choices=list(CodecName),
+    )
+    ap.add_argument(
+        "-cl",
+        "--codec_level",
+        help="Compression level, codec default if unset",
+        type=int,
+        default=None,
+    )
+    ap.add_argument(
+        "-ct",
+        "--codec_threads",
+        help="Number of compression threads, 0 for one per CPU",
+        type=int,
+        default=1,
+    )
+    ap.add_argument(
+        "-zd",
+        "--zstd_dictionary",
+        help="Path to a trained zstd dictionary",
+        type=str,
+        default=None,
+    )
+    ap.add_argument(
+        "-pf",
+        "--profile",
+        help="Path to a traffic profile of several flows, replacing the protocol and frame options",
+        type=str,
+        default=None,
+    )
+    ap.add_argument(
+        "-lf",
+        "--log_format",
+        help="Log format, json being queued to a thread and rotated by size",
+        type=str,
+        default=LOG_FORMATS[0],
+        choices=LOG_FORMATS,
+    )
+    ap.add_argument(
+        "-lr",
+        "--log_ring",
+        help="Number of debug records kept in memory and only written on failure, 0 to write them all",
+        type=int,
+        default=LOG_RING_RECORDS,
+    )
     # ====== Verify arguments value =============================================
     options = ap.parse_args()
     if (options.dport < 1) or (options.dport > 65535):
@@ -228,40 +673,151 @@ if __name__ == "__main__":
     if (options.time < 0) or (options.time > 60):
         sys.stderr.write(f"ERROR: Invalid time {options.time}!\n")
         sys.exit(1)
+    if options.grace < 0:
+        sys.stderr.write(f"ERROR: Invalid grace {options.grace}!\n")
+        sys.exit(1)
+    if options.log_ring < 0:
+        sys.stderr.write(f"ERROR: Invalid log ring {options.log_ring}!\n")
+        sys.exit(1)
     if options.interval < 0:
-        sys.stderr.write(f"ERROR: Invalid interval {options.bitrate}!\n")
+        sys.stderr.write(f"ERROR: Invalid interval {options.interval}!\n")
+        sys.exit(1)
+    if options.offset is None:
+        options.offset = node_offset(
+            read_node_id(), options.instance, DEFAULT_OFFSET_SPREAD
+        )
+    try:
+        if options.schedule is not None:
+            scheduler = CronScheduler(options.schedule, options.offset)
+        else:
+            scheduler = IntervalScheduler(options.interval * 60, options.offset)
+    except Exception as e:
+        sys.stderr.write(f"ERROR: Invalid schedule {options.schedule}: {e}!\n")
         sys.exit(1)
     if options.transport_protocol not in list(TransportProtocol):
         sys.stderr.write(
             f"ERROR: Invalid transport protocol {options.transport_protocol}!\n"
         )
         sys.exit(1)
+    # netperfmeter flow arguments, of the profile or of the single flow options
+    if options.profile is not None:
+        try:
+            flow_arguments = load_profile(options.profile)
+        except Exception as e:
+            sys.stderr.write(f"ERROR: Invalid profile {options.profile}: {e}!\n")
+            sys.exit(1)
+    else:
+        flow_arguments = [
+            f"-{options.transport_protocol.value}",
+            f"const{options.outgoing_frame_rate}:const{options.outgoing_frame_size}:const{options.incoming_frame_rate}:const{options.incoming_frame_size}",
+        ]
     if options.uncompressed is True:
-        COMPRESS = False
+        options.codec = CodecName.BZ2
+    if (
+        (options.retention_mb < 0)
+        or (options.retention_files < 0)
+        or (options.min_free_mb < 0)
+        or (options.staging_mb < 0)
+    ):
+        sys.stderr.write("ERROR: Invalid retention budget!\n")
+        sys.exit(1)
+    if options.codec_threads < 0:
+        sys.stderr.write(f"ERROR: Invalid codec threads {options.codec_threads}!\n")
+        sys.exit(1)
+    try:
+        codec = get_codec(
+            options.codec,
+            options.codec_level,
+            options.codec_threads,
+            options.zstd_dictionary,
+        )
+    except Exception as e:
+        sys.stderr.write(f"ERROR: Invalid codec {options.codec.value}: {e}!\n")
+        sys.exit(1)
     # ====== Make sure the output directories exist =============================
-    for directory in [LOG_DIRECTORY, FINAL_RESULT_DIRECTORY, TMP_RESULT_DIRECTORY]:
+    for directory in [
+        LOG_DIRECTORY,
+        FINAL_RESULT_DIRECTORY,
+        TMP_RESULT_DIRECTORY,
+        DERIVED_DIRECTORY,
+    ]:
         try:
             os.makedirs(directory, 0o755, True)
         except Exception:
             sys.stderr.write("ERROR: Unable to create directory " + directory + "!\n")
             sys.exit(1)
+    try:
+        journal = RunJournal(JOURNAL_DIRECTORY, options.instance)
+    except Exception:
+        sys.stderr.write(f"ERROR: Unable to create directory {JOURNAL_DIRECTORY}!\n")
+        sys.exit(1)
+    bundler = None
+    if options.bundle:
+        try:
+            bundler = DailyBundler(BUNDLE_DIRECTORY, options.instance)
+        except Exception:
+            sys.stderr.write(f"ERROR: Unable to create directory {BUNDLE_DIRECTORY}!\n")
+            sys.exit(1)
+    try:
+        staging = StagingArea(
+            STAGING_DIRECTORY if options.staging_mb > 0 else None,
+            TMP_RESULT_DIRECTORY,
+            options.staging_mb * 1024 * 1024,
+        )
+    except Exception:
+        sys.stderr.write(f"ERROR: Unable to create directory {STAGING_DIRECTORY}!\n")
+        sys.exit(1)
+    retention = RetentionManager(
+        [
+            FINAL_RESULT_DIRECTORY,
+            TMP_RESULT_DIRECTORY,
+            DERIVED_DIRECTORY,
+            BUNDLE_DIRECTORY,
+        ],
+        options.retention_mb * 1024 * 1024,
+        options.retention_files,
+        options.min_free_mb * 1024 * 1024,
+        not options.retention_by_age,
+        journal.pending_files,
+        # retention may run alongside a step, which may be writing a file
+        lambda: WORKER.step_time,
+    )
     # ====== Initialise logger ==================================================
     LOGGING_CONF = {
         "version": 1,
         "handlers": {
-            "default": {
-                "level": "DEBUG",
-                "class": "logging.handlers.TimedRotatingFileHandler",
-                "formatter": "standard",
-                "filename": (LOG_DIRECTORY + "/netperfmeter_%d.log")
+            "default": file_handler_config(
+                (LOG_DIRECTORY + "/netperfmeter_%d.log") % (options.instance),
+                options.log_format,
+            ),
+            "cycles": {
+                "level": "INFO",
+                "class": "logging.handlers.RotatingFileHandler",
+                "formatter": "event",
+                "filename": (LOG_DIRECTORY + "/netperfmeter_%d_cycles.jsonl")
+                % (options.instance),
+                "maxBytes": CYCLE_LOG_SIZE,
+                "backupCount": CYCLE_LOG_BACKUPS,
+            },
+            "codec": {
+                "level": "INFO",
+                "class": "logging.handlers.RotatingFileHandler",
+                "formatter": "event",
+                "filename": (LOG_DIRECTORY + "/netperfmeter_%d_codec.jsonl")
                 % (options.instance),
-                "when": "D",
+                "maxBytes": CYCLE_LOG_SIZE,
+                "backupCount": CYCLE_LOG_BACKUPS,
             },
         },
         "formatters": {
-            "standard": {
-                "format": "%(asctime)s %(levelname)s [PID=%(process)d] %(message)s"
-            },
+            **FORMATTERS_CONFIG,
+            "event": {"format": "%(message)s"},
+        },
+        "loggers": {
+            # one JSON event per measurement cycle, not in the main log
+            CYCLE_LOGGER: {"handlers": ["cycles"], "propagate": False},
+            # one JSON report per transcoded run, rotated like the cycle events
+            CODEC_LOGGER: {"handlers": ["codec"], "propagate": False},
         },
         "root": {
             "level": "DEBUG",
@@ -269,61 +825,233 @@ if __name__ == "__main__":
         },
     }
     logging.config.dictConfig(LOGGING_CONF)
+    set_log_context(instance=options.instance)
+    if options.log_ring > 0:
+        # debug records, e.g. the netperfmeter output, only hit the disk on failure
+        start_ring_buffer(logging.getLogger(), options.log_ring)
+    log_listener = None
+    if options.log_format == "json":
+        # records are written by a listener thread, off the measurement loop
+        log_listener = start_queue_logging(logging.getLogger())
+    # ====== Export metrics =====================================================
+    METRICS.labels["instance"] = str(options.instance)
+    metrics_exporter = TextfileExporter(
+        METRICS, f"{LOG_DIRECTORY}/netperfmeter_{options.instance}.prom"
+    )
+    metrics_server = None
+    if options.metrics_socket_directory is not None:
+        try:
+            metrics_server = SocketExporter(
+                METRICS,
+                f"{options.metrics_socket_directory}/netperfmeter_{options.instance}.sock",
+            )
+        except OSError as e:
+            logging.warning("Cannot serve metrics: %s", str(e))
+    # ====== Monitor interface addresses ========================================
+    ADDRESS_MONITOR = AddressMonitor()
+    # ====== Start background post-processing ===================================
+    WORKER = BackgroundWorker(
+        functools.partial(
+            post_process_job,
+            options=options,
+            codec=codec,
+            bundler=bundler,
+            journal=journal,
+        ),
+        "post-process",
+    )
+    # unfinished runs of a previous instance are processed first
+    for manifest in journal.unfinished():
+        logging.info("Resuming run %s from %s", manifest["run"], manifest["state"])
+        WORKER.submit(
+            {
+                "manifest": manifest,
+                "timer": CycleTimer(
+                    manifest["run"], instance=options.instance, resumed=True
+                ),
+            }
+        )
+    # bundles of past days left by a stopped instance are published next
+    if bundler is not None:
+        WORKER.submit({"seal": datetime.now().strftime("%Y-%m-%d")})
     # ====== Initialise signal handlers ===============================
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     # ====== Main loop ==========================================================
-    while RUNNING is True:
+    next_run = scheduler.next_run(time.time())
+    retry_policy = RetryPolicy()
+    while not SHUTDOWN.is_set():
+        # cause of the failure if the current step raises
+        phase = FailureClass.OTHER
+        timer = None
         try:
-            # ----- Run experiments -------------------------------------------------
-            # retrieve formatted now UTC datetime ISO8601
-            utc_now_iso8601 = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-            # retrieve network interface ip from name
-            iface_ip = get_network_interface_ip_address(options.iface, 4)
-            # netperfmeter cmd
-            cmd = [
-                NETPERFMETER_BINARY,
-                f"{options.daddr}:{options.dport}",
+            # ----- Wait for the next slot ------------------------------------------
+            delay = next_run - time.time()
+            if delay > 0:
+                logging.debug(
+                    "Waiting %.0f seconds until %s",
+                    delay,
+                    datetime.fromtimestamp(next_run, timezone.utc).strftime(
+                        "%Y-%m-%dT%H:%M:%SZ"
+                    ),
+                )
+                SHUTDOWN.wait(delay)
+            if SHUTDOWN.is_set():
+                break
+            # ----- Wait for the background step in progress -----------------------
+            # no background step starts during retention and measurement, and
+            # a long one only delays the slot by STEP_TIMEOUT
+            with WORKER.measurement(STEP_TIMEOUT):
+                # retrieve formatted now UTC datetime ISO8601
+                utc_now_iso8601 = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+                timer = CycleTimer(utc_now_iso8601, instance=options.instance)
+                # ----- Enforce retention -----------------------------------------------
+                phase = FailureClass.STORAGE
+                with timer.phase("retention"):
+                    retention.enforce()
+                usage = retention.usage()
+                RESULT_BYTES.set(usage["bytes"])
+                FREE_BYTES.set(usage["free_bytes"])
+                logging.debug("Retention usage %s", json.dumps(usage))
+                if not retention.has_room():
+                    raise RuntimeError(
+                        f"{usage['free_bytes']} bytes free, below {usage['min_free_bytes']}"
+                    )
+                # ----- Run experiments -------------------------------------------------
+                # raw results are written to memory while they fit in the budget
+                staging_directory = staging.directory()
+                # retrieve network interface ip from name
+                phase = FailureClass.INTERFACE
+                with timer.phase("interface"):
+                    # a modem between attachments gets its address back shortly
+                    iface_ip = ADDRESS_MONITOR.wait_for_address(
+                        options.iface, INTERFACE_TIMEOUT, 4, SHUTDOWN
+                    )
+                if SHUTDOWN.is_set():
+                    break
+                if iface_ip is None:
+                    raise RuntimeError(f"no IPv4 address on {options.iface}")
                 # generate file within the same folder
-                f"-vector={TMP_RESULT_DIRECTORY}/netperfmeter_{options.instance}_vector_{utc_now_iso8601}.vec.bz2",
-                f"-scalar={TMP_RESULT_DIRECTORY}/netperfmeter_{options.instance}_scalar_{utc_now_iso8601}.vec.bz2",
-                "-control-over-tcp",
-                f"-local={iface_ip}",
-                f"-{options.transport_protocol.value}",
-                f"const{options.outgoing_frame_rate}:const{options.outgoing_frame_size}:const{options.incoming_frame_rate}:const{options.incoming_frame_size}",
-                f"-runtime={options.time}",
-            ]
-            logging.debug("Running %s", str(cmd))
-            # instanciate netperfmeter and retrie output
-            output = subprocess.check_output(cmd).decode("ascii")
-            logging.debug("%s", str(output))
-            # ----- Compress data ------------------------------------------------
-            # for every data file
-            for file_path in glob.glob(
-                f"{TMP_RESULT_DIRECTORY}/netperfmeter_{options.instance}_*"
-            ):
-                # compress each file since wildcard not working in container
+                vector_path = f"{staging_directory}/netperfmeter_{options.instance}_vector_{utc_now_iso8601}.vec.bz2"
+                scalar_path = f"{staging_directory}/netperfmeter_{options.instance}_scalar_{utc_now_iso8601}.vec.bz2"
+                # netperfmeter cmd
                 cmd = [
-                    XZ_BINARY,
-                    "--compress",
-                    file_path,
+                    NETPERFMETER_BINARY,
+                    f"{options.daddr}:{options.dport}",
+                    f"-vector={vector_path}",
+                    f"-scalar={scalar_path}",
+                    "-control-over-tcp",
+                    f"-local={iface_ip}",
+                    *flow_arguments,
+                    f"-runtime={options.time}",
                 ]
-                # instanciate xz process
-                subprocess.run(cmd, check=True)
-            # ----- Copy compress data to directory  --------------------------------
-            # for every compressed file
-            for file_path in glob.glob(
-                f"{TMP_RESULT_DIRECTORY}/netperfmeter_{options.instance}_*.xz"
-            ):
-                # safely copy compress file to final directory
-                safe_copy_file_to_dir(file_path, FINAL_RESULT_DIRECTORY)
-            logging.debug("Waiting %s minutes", str(options.interval))
-            # sleep m minutes until next measurement
-            time.sleep(options.interval * 60)
+                logging.debug("Running %s", str(cmd))
+                phase = FailureClass.MEASUREMENT
+                # instanciate netperfmeter and stream its output
+                monitor = ProgressMonitor(
+                    f"{LOG_DIRECTORY}/netperfmeter_{options.instance}_progress.json",
+                    utc_now_iso8601,
+                )
+                RUNS_STARTED.inc()
+                MEASURING.set(1)
+                with timer.phase("measurement") as record:
+                    NETPERFMETER_PROCESS = subprocess.Popen(
+                        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+                    )
+                    try:
+                        returncode, output, timed_out = stream_output(
+                            NETPERFMETER_PROCESS,
+                            monitor,
+                            options.time + options.grace,
+                            SHUTDOWN_TIMEOUT,
+                        )
+                    finally:
+                        if NETPERFMETER_PROCESS.poll() is None:
+                            NETPERFMETER_PROCESS.kill()
+                        NETPERFMETER_PROCESS.wait()
+                        NETPERFMETER_PROCESS.stdout.close()
+                        NETPERFMETER_PROCESS = None
+                        MEASURING.set(0)
+                    record["bytes"] += sum(
+                        os.path.getsize(path)
+                        for path in [vector_path, scalar_path]
+                        if os.path.exists(path)
+                    )
+                RUN_DURATION.observe(record["wall"])
+            # record the results, even partial, before anything else happens
+            run_files = [
+                path for path in [vector_path, scalar_path] if os.path.exists(path)
+            ]
+            if run_files:
+                staging.record(run_files)
+                manifest = journal.create(utc_now_iso8601, staging_directory, run_files)
+                timer.event.update({"returncode": returncode, "timed_out": timed_out})
+                # summarize, transcode and publish in the background
+                WORKER.submit({"manifest": manifest, "timer": timer})
+                QUEUE_DEPTH.set(WORKER.counters()["queued"])
+                # the worker emits the cycle event
+                timer = None
+            if timed_out:
+                raise subprocess.TimeoutExpired(
+                    cmd, options.time + options.grace, output
+                )
+            # results of a run interrupted by shutdown are still kept
+            if (returncode != 0) and not SHUTDOWN.is_set():
+                raise subprocess.CalledProcessError(returncode, cmd, output)
+            if timer is not None:
+                timer.emit("ok")
+            retry_policy.success()
+            RUNS_SUCCEEDED.inc()
+            LAST_SUCCESS.set(round(time.time()))
+            # schedule next measurement from the wall clock, not from now + interval
+            next_run = scheduler.next_run(time.time())
 
         # ====== Handle error ====================================================
         except Exception as e:
-            logging.warning("Sleeping: %s", str(e))
-            time.sleep(SLEEP_ON_ERROR)
+            if timer is not None:
+                timer.emit(phase.value)
+            delay = retry_policy.failure(phase)
+            RUNS_FAILED.inc(failure_class=phase.value)
+            logging.warning(
+                "Sleeping %.0f seconds after %s failure: %s (failures %s)",
+                delay,
+                phase.value,
+                str(e),
+                str(retry_policy.counters()),
+                extra=DUMP_EXTRA,
+            )
+            if phase == FailureClass.INTERFACE:
+                # the run starts as soon as the interface has an address again
+                ADDRESS_MONITOR.wait_for_address(options.iface, delay, 4, SHUTDOWN)
+            else:
+                SHUTDOWN.wait(delay)
 
-    logging.debug("Exiting")
+    # on shutdown, queued runs are published without transcoding, and runs
+    # still queued at the deadline are resumed from the journal on restart
+    drain_start = SHUTDOWN_TIME if SHUTDOWN_TIME is not None else time.monotonic()
+    if not WORKER.drain(
+        max(0, drain_start + SHUTDOWN_DRAIN_DEADLINE - time.monotonic())
+    ):
+        logging.warning(
+            "Leaving the current run and %d queued runs to the journal",
+            WORKER.counters()["queued"],
+        )
+    elif bundler is not None:
+        # the last bundles are not left unpublished until the next run
+        syncer = DirectorySyncer()
+        try:
+            publish_past_bundles(bundler, datetime.now().strftime("%Y-%m-%d"), syncer)
+            syncer.sync()
+        except Exception as e:
+            logging.warning("Cannot publish bundles: %s", str(e))
+    metrics_exporter.close()
+    if metrics_server is not None:
+        metrics_server.close()
+    if SHUTDOWN_TIME is not None:
+        logging.debug(
+            "Exiting %.3f s after shutdown request", time.monotonic() - SHUTDOWN_TIME
+        )
+    else:
+        logging.debug("Exiting")
+    if log_listener is not None:
+        log_listener.stop()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Netperfmeter Output Streaming and Progress for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import collections
+import json
+import logging
+import os
+import re
+import select
+import signal
+import time
+
+
+# ###### Constants ##########################################################
+# progress line, e.g. "<-> Duration: 10s   Flows: 1   Transmitted: 1.2 MiB at
+# 1000.0 Kbit/s   Received: 0.1 MiB at 80.0 Kbit/s"
+DURATION_PATTERN = re.compile(r"Duration:\s*([\d.]+)\s*s")
+FLOWS_PATTERN = re.compile(r"Flows:\s*(\d+)")
+TRANSFER_PATTERN = re.compile(
+    r"(Transmitted|Received):\s*([\d.]+)\s*([KMGT]?i?B)\s+at\s+([\d.]+)\s*([kKMGT]?)bit/s"
+)
+# bytes per size unit and bit/s per rate unit
+SIZE_UNITS = {
+    "B": 1,
+    "KB": 1000,
+    "MB": 1000**2,
+    "GB": 1000**3,
+    "TB": 1000**4,
+    "KiB": 1024,
+    "MiB": 1024**2,
+    "GiB": 1024**3,
+    "TiB": 1024**4,
+}
+RATE_UNITS = {"": 1, "k": 1e3, "K": 1e3, "M": 1e6, "G": 1e9, "T": 1e12}
+# direction names of the counters
+DIRECTIONS = {"Transmitted": "outgoing", "Received": "incoming"}
+# size of the reads from the output pipe (in B)
+READ_SIZE = 64 * 1024
+# longest line kept, longer ones are cut (in B)
+MAX_LINE_SIZE = 64 * 1024
+# number of output lines kept for error reports
+OUTPUT_TAIL_LINES = 100
+# minimum time between two writes of the progress file (in s)
+PROGRESS_WRITE_INTERVAL = 1.0
+
+
+def parse_progress(line: str) -> dict:
+    """Parse a netperfmeter progress line
+
+    Args:
+        line (str): output line
+
+    Returns:
+        dict: duration, flows, and bytes and bit/s per direction, None if the
+            line is not a progress line
+    """
+    transfers = TRANSFER_PATTERN.findall(line)
+    if not transfers:
+        return None
+    progress = {}
+    duration = DURATION_PATTERN.search(line)
+    if duration is not None:
+        progress["duration"] = float(duration.group(1))
+    flows = FLOWS_PATTERN.search(line)
+    if flows is not None:
+        progress["flows"] = int(flows.group(1))
+    for name, size, size_unit, rate, rate_unit in transfers:
+        direction = DIRECTIONS[name]
+        progress[f"{direction}_bytes"] = int(float(size) * SIZE_UNITS[size_unit])
+        progress[f"{direction}_bps"] = float(rate) * RATE_UNITS[rate_unit]
+    return progress
+
+
+class ProgressMonitor:
+    """Class keeping the live progress counters of a run
+
+    The counters are written as JSON to a progress file, atomically and at
+    most once per PROGRESS_WRITE_INTERVAL, so that other processes can follow
+    a running measurement.
+    """
+
+    def __init__(self, progress_path: str, run: str):
+        """
+        Args:
+            progress_path (str): path to the progress file, None for no file
+            run (str): run identifier
+        """
+        self.progress_path = progress_path
+        self.counters = {"run": run, "running": True, "updates": 0}
+        self.last_write = None
+
+    def update(self, progress: dict):
+        """Update the counters with a parsed progress line
+
+        Args:
+            progress (dict): parsed progress line
+        """
+        self.counters.update(progress)
+        self.counters["updates"] += 1
+        now = time.monotonic()
+        if (self.last_write is None) or (
+            now - self.last_write >= PROGRESS_WRITE_INTERVAL
+        ):
+            self.write()
+
+    def finish(self, returncode: int):
+        """Record the end of the run
+
+        Args:
+            returncode (int): netperfmeter exit code
+        """
+        self.counters["running"] = False
+        self.counters["returncode"] = returncode
+        self.write()
+
+    def write(self):
+        """Write the counters to the progress file"""
+        self.last_write = time.monotonic()
+        if self.progress_path is None:
+            return
+        self.counters["time"] = round(time.time(), 3)
+        tmp_file = f"{self.progress_path}.tmp"
+        try:
+            with open(tmp_file, "w") as progress_file:
+                json.dump(self.counters, progress_file)
+            os.replace(tmp_file, self.progress_path)
+        except OSError as e:
+            logging.debug("Cannot write progress: %s", str(e))
+
+
+def stream_output(
+    process, monitor: ProgressMonitor, timeout: float, kill_timeout: float
+) -> tuple:
+    """Stream the output of netperfmeter until it exits
+
+    Lines, ended by "\\n" or by the "\\r" of progress updates, are parsed as
+    they come: progress lines update the monitor, other lines are logged.
+    Only the last lines are kept, so memory does not grow with the output.
+    A watchdog stops the run with SIGINT once the timeout is over, then kills
+    it if it is still running after the kill timeout.
+
+    Args:
+        process (subprocess.Popen): netperfmeter process, stdout a pipe
+        monitor (ProgressMonitor): monitor of the progress counters
+        timeout (float): time after which the run is stopped (in s)
+        kill_timeout (float): time after stopping before killing (in s)
+
+    Returns:
+        tuple: (exit code, last output lines as str, True if the watchdog fired)
+    """
+    fd = process.stdout.fileno()
+    tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+    pending = b""
+    deadline = time.monotonic() + timeout
+    fired = False
+    while True:
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if not fired:
+                    logging.warning(
+                        "Stopping netperfmeter still running after %.0f s", timeout
+                    )
+                    process.send_signal(signal.SIGINT)
+                    fired = True
+                    deadline = time.monotonic() + kill_timeout
+                else:
+                    logging.warning("Killing netperfmeter")
+                    process.kill()
+                    deadline = None
+                continue
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            continue
+        data = os.read(fd, READ_SIZE)
+        # at the end of the output, the last line may not be terminated
+        lines = re.split(rb"[\r\n]", pending + data) if data else [pending]
+        pending = lines.pop() if data else b""
+        if len(pending) > MAX_LINE_SIZE:
+            lines.append(pending)
+            pending = b""
+        for raw_line in lines:
+            line = raw_line.decode("utf-8", "replace").strip()
+            if not line:
+                continue
+            progress = parse_progress(line)
+            if progress is not None:
+                monitor.update(progress)
+                continue
+            logging.debug("netperfmeter: %s", line)
+            tail.append(line)
+        if not data:
+            break
+    returncode = process.wait()
+    if monitor.counters["updates"]:
+        logging.debug("Last progress %s", json.dumps(monitor.counters))
+    monitor.finish(returncode)
+    return returncode, "\n".join(tail), fired
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Durable Result Publishing for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import errno
+import os
+import pathlib
+import shutil
+
+
+# ###### Constants ##########################################################
+# maximum number of bytes per copy_file_range/sendfile call
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+# errors telling a kernel fast path is not available for these files
+UNSUPPORTED_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+# file systems on which O_TMPFILE files cannot be linked, to skip the attempt
+UNLINKABLE_DEVICES = set()
+
+
+def fsync_directory(directory: str):
+    """Flush a directory, making the entries created or renamed in it durable
+
+    Args:
+        directory (str): path to the directory
+    """
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DirectorySyncer:
+    """Class batching the fsync of directories
+
+    Directories of files published together are flushed once, when sync() is
+    called, instead of once per file.
+    """
+
+    def __init__(self):
+        self.directories = set()
+
+    def add(self, directory: str):
+        """Register a directory to flush
+
+        Args:
+            directory (str): path to the directory
+        """
+        self.directories.add(str(directory))
+
+    def sync(self):
+        """Flush every registered directory"""
+        for directory in sorted(self.directories):
+            fsync_directory(directory)
+        self.directories.clear()
+
+
+def copy_file_data(source_fd: int, destination_fd: int, size: int):
+    """Copy file data within the kernel when possible
+
+    copy_file_range() is tried first, as it may share blocks or avoid any
+    copy on file systems supporting it, then sendfile(), then a plain copy.
+
+    Args:
+        source_fd (int): descriptor of the source file, at offset 0
+        destination_fd (int): descriptor of the empty destination file
+        size (int): number of bytes to copy
+    """
+    copied = 0
+    try:
+        while copied < size:
+            count = os.copy_file_range(
+                source_fd, destination_fd, min(COPY_CHUNK_SIZE, size - copied)
+            )
+            if count == 0:
+                break
+            copied += count
+        return
+    except (AttributeError, OSError) as e:
+        if isinstance(e, OSError) and (e.errno not in UNSUPPORTED_ERRORS):
+            raise
+    try:
+        while copied < size:
+            count = os.sendfile(
+                destination_fd, source_fd, copied, min(COPY_CHUNK_SIZE, size - copied)
+            )
+            if count == 0:
+                break
+            copied += count
+        return
+    except OSError as e:
+        if e.errno not in UNSUPPORTED_ERRORS:
+            raise
+    os.lseek(source_fd, copied, os.SEEK_SET)
+    os.lseek(destination_fd, copied, os.SEEK_SET)
+    with open(source_fd, "rb", closefd=False) as reader, open(
+        destination_fd, "wb", closefd=False
+    ) as writer:
+        shutil.copyfileobj(reader, writer)
+
+
+def write_copy(source_fd: int, destination_fd: int):
+    """Write a durable copy of a file, keeping its mode and times
+
+    Args:
+        source_fd (int): descriptor of the source file
+        destination_fd (int): descriptor of the empty destination file
+    """
+    stat = os.fstat(source_fd)
+    os.lseek(source_fd, 0, os.SEEK_SET)
+    copy_file_data(source_fd, destination_fd, stat.st_size)
+    os.fchmod(destination_fd, stat.st_mode & 0o7777)
+    os.utime(destination_fd, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.fsync(destination_fd)
+
+
+def link_tmpfile(source_fd: int, directory: str, tmp_path: str) -> bool:
+    """Copy a file to an unnamed O_TMPFILE file, then link it to a path
+
+    A crash during the copy leaves nothing behind in the directory.
+
+    Args:
+        source_fd (int): descriptor of the source file
+        directory (str): destination directory
+        tmp_path (str): path to link the complete copy to
+
+    Returns:
+        bool: False if the file system does not support it
+    """
+    device = os.stat(directory).st_dev
+    if device in UNLINKABLE_DEVICES:
+        return False
+    try:
+        fd = os.open(directory, os.O_TMPFILE | os.O_WRONLY, 0o600)
+    except AttributeError:
+        return False
+    except OSError as e:
+        if e.errno in UNSUPPORTED_ERRORS | {errno.EISDIR}:
+            UNLINKABLE_DEVICES.add(device)
+            return False
+        raise
+    try:
+        write_copy(source_fd, fd)
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        os.link(f"/proc/self/fd/{fd}", tmp_path, follow_symlinks=True)
+    except OSError as e:
+        # linking may be refused, e.g. by overlay file systems
+        if e.errno in UNSUPPORTED_ERRORS | {errno.ENOENT}:
+            UNLINKABLE_DEVICES.add(device)
+            return False
+        raise
+    finally:
+        os.close(fd)
+    return True
+
+
+def copy_durably(source: pathlib.Path, destination: pathlib.Path):
+    """Copy a file durably and atomically, keeping its mode and times
+
+    Args:
+        source (pathlib.Path): path to the source file
+        destination (pathlib.Path): path to the destination file
+    """
+    tmp_path = f"{destination}.tmp"
+    with open(source, "rb") as source_file:
+        if not link_tmpfile(source_file.fileno(), str(destination.parent), tmp_path):
+            fd = os.open(tmp_path, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600)
+            try:
+                write_copy(source_file.fileno(), fd)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            finally:
+                os.close(fd)
+    os.replace(tmp_path, destination)
+
+
+def publish_file(
+    file_path: str,
+    directory: str,
+    keep_source: bool = False,
+    syncer: DirectorySyncer = None,
+) -> str:
+    """Publish a file to a directory, durably and atomically
+
+    On the same file system, the file is renamed (or hard-linked to keep the
+    source), so no data is written again. Across file systems or mounts, it
+    is copied within the kernel to a temporary file, flushed and renamed.
+
+    Args:
+        file_path (str): path to the file
+        directory (str): destination directory
+        keep_source (bool): keep the source file
+        syncer (DirectorySyncer): syncer batching the directory flush, the
+            directory is flushed immediately if None
+
+    Returns:
+        str: path to the published file
+    """
+    source = pathlib.Path(file_path)
+    destination = pathlib.Path(directory) / source.name
+    renamed = False
+    if os.stat(source).st_dev == os.stat(directory).st_dev:
+        with open(source, "rb") as source_file:
+            os.fsync(source_file.fileno())
+        try:
+            if keep_source:
+                tmp_path = f"{destination}.tmp"
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                os.link(source, tmp_path)
+                os.replace(tmp_path, destination)
+            else:
+                os.replace(source, destination)
+                # renaming a hard link onto another link of the same file does nothing
+                if os.path.lexists(source):
+                    os.remove(source)
+            renamed = True
+        except OSError as e:
+            # two bind mounts of one file system share st_dev, but refuse links
+            # and renames between them
+            if e.errno != errno.EXDEV:
+                raise
+    if not renamed:
+        copy_durably(source, destination)
+        if not keep_source:
+            os.remove(source)
+    if syncer is not None:
+        syncer.add(directory)
+    else:
+        fsync_directory(directory)
+    return str(destination)
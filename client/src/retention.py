@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Result Retention for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import logging
+import os
+from bundle import TOC_SUFFIX
+
+
+# ###### Constants ##########################################################
+# prefix of the files managed by retention
+RESULT_FILE_PREFIX = "netperfmeter_"
+# eviction priority per file kind, lowest evicted first
+PRIORITY_RAW_VECTOR = 0
+PRIORITY_COLUMNAR = 1
+PRIORITY_RAW_SCALAR = 2
+PRIORITY_BUNDLE = 2
+PRIORITY_SUMMARY = 3
+
+
+def file_priority(name: str) -> int:
+    """Get eviction priority of a result file from its name
+
+    Args:
+        name (str): file name
+
+    Returns:
+        int: priority, lowest evicted first
+    """
+    # the table of contents of a bundle goes with it
+    if "_bundle_" in name:
+        return PRIORITY_BUNDLE
+    if name.endswith(".json"):
+        return PRIORITY_SUMMARY
+    if name.endswith(".npz"):
+        return PRIORITY_COLUMNAR
+    if "_vector_" in name:
+        return PRIORITY_RAW_VECTOR
+    return PRIORITY_RAW_SCALAR
+
+
+class ResultFile:
+    """Class describing a result file known to retention"""
+
+    def __init__(self, path: str, size: int, mtime: float):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.priority = file_priority(os.path.basename(path))
+
+
+class RetentionManager:
+    """Class keeping result directories within a byte and file budget
+
+    Files are evicted until the budget holds, either by priority (raw
+    vectors first, summaries last) then age, or by age only. Files still to
+    be processed, e.g. raw results of a run not published yet, and files
+    written since a background step started, are never evicted. Below a
+    floor of free space on the result file system, measurements should pause.
+    """
+
+    def __init__(
+        self,
+        directories: list,
+        max_bytes: int = 0,
+        max_files: int = 0,
+        min_free_bytes: int = 0,
+        by_priority: bool = True,
+        pending_files=None,
+        busy_since=None,
+    ):
+        """
+        Args:
+            directories (list): directories whose result files are managed
+            max_bytes (int): budget of bytes, 0 for no budget
+            max_files (int): budget of files (inodes), 0 for no budget
+            min_free_bytes (int): free space below which measurements pause
+            by_priority (bool): evict by priority then age, or by age only
+            pending_files (callable): function giving the set of paths not to
+                evict, None to evict any file
+            busy_since (callable): function giving the wall-clock time since
+                which files may still be written, None if no file is
+        """
+        self.directories = directories
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.min_free_bytes = min_free_bytes
+        self.by_priority = by_priority
+        self.pending_files = pending_files
+        self.busy_since = busy_since
+        # totals of the last scan, and evictions since start
+        self.bytes = 0
+        self.files = 0
+        self.evicted_bytes = 0
+        self.evicted_files = 0
+
+    def scan(self) -> list:
+        """Index the result files of the managed directories
+
+        Returns:
+            list: ResultFile of every result file, next to evict first
+        """
+        result_files = []
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not (entry.name.startswith(RESULT_FILE_PREFIX) and entry.is_file()):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                result_files.append(ResultFile(entry.path, stat.st_size, stat.st_mtime))
+        if self.by_priority:
+            result_files.sort(key=lambda result: (result.priority, result.mtime))
+        else:
+            result_files.sort(key=lambda result: result.mtime)
+        self.bytes = sum(result.size for result in result_files)
+        self.files = len(result_files)
+        return result_files
+
+    def is_over_budget(self) -> bool:
+        """Check if the last scan exceeds the budget
+
+        Returns:
+            bool: True if bytes or files are over budget
+        """
+        return ((self.max_bytes > 0) and (self.bytes > self.max_bytes)) or (
+            (self.max_files > 0) and (self.files > self.max_files)
+        )
+
+    def enforce(self) -> list:
+        """Evict result files until the budget holds
+
+        Returns:
+            list: paths to the evicted files
+        """
+        evicted = []
+        pending = self.pending_files() if self.pending_files is not None else set()
+        since = self.busy_since() if self.busy_since is not None else None
+        for result in self.scan():
+            if not self.is_over_budget():
+                break
+            if result.path in pending:
+                continue
+            if (since is not None) and (result.mtime >= since):
+                continue
+            # a bundle is evicted with its table of contents
+            paths = [result.path]
+            if os.path.exists(result.path + TOC_SUFFIX):
+                paths.append(result.path + TOC_SUFFIX)
+            for path in paths:
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self.bytes -= size
+                self.files -= 1
+                self.evicted_bytes += size
+                self.evicted_files += 1
+                evicted.append(path)
+        if evicted:
+            logging.warning(
+                "Retention evicted %d files: %s", len(evicted), ", ".join(evicted)
+            )
+        return evicted
+
+    def free_bytes(self) -> int:
+        """Get free space of the fullest file system of the managed directories
+
+        Returns:
+            int: bytes available to unprivileged users
+        """
+        free = []
+        for directory in self.directories:
+            try:
+                stat = os.statvfs(directory)
+            except FileNotFoundError:
+                continue
+            free.append(stat.f_bavail * stat.f_frsize)
+        return min(free) if free else 0
+
+    def has_room(self) -> bool:
+        """Check if there is enough free space to measure
+
+        Returns:
+            bool: True if free space is above the floor
+        """
+        return self.free_bytes() >= self.min_free_bytes
+
+    def usage(self) -> dict:
+        """Get usage metrics
+
+        Returns:
+            dict: managed bytes and files, budgets, free space and evictions
+        """
+        return {
+            "bytes": self.bytes,
+            "files": self.files,
+            "max_bytes": self.max_bytes,
+            "max_files": self.max_files,
+            "free_bytes": self.free_bytes(),
+            "min_free_bytes": self.min_free_bytes,
+            "evicted_bytes": self.evicted_bytes,
+            "evicted_files": self.evicted_files,
+        }
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Retry Policies for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import random
+from enum import Enum
+
+
+# ###### Constants ##########################################################
+class FailureClass(Enum):
+    """Class enum for the causes of a failed measurement cycle"""
+
+    # the interface has no address (modem between attachments)
+    INTERFACE = "interface"
+    # netperfmeter could not be run or exited with an error
+    MEASUREMENT = "measurement"
+    # results could not be transcoded
+    COMPRESSION = "compression"
+    # results could not be copied to the final directory
+    PUBLISH = "publish"
+    # free space is below the floor, measurements pause
+    STORAGE = "storage"
+    # anything else
+    OTHER = "other"
+
+
+class ClassifiedError(Exception):
+    """Class of the errors raised with the cause of the failure"""
+
+    def __init__(self, failure_class: FailureClass, error: Exception):
+        """
+        Args:
+            failure_class (FailureClass): cause of the failure
+            error (Exception): original error
+        """
+        super().__init__(str(error))
+        self.failure_class = failure_class
+
+
+class BackoffPolicy:
+    """Class computing exponential backoff delays with jitter"""
+
+    def __init__(self, base: float, factor: float, maximum: float, jitter: float):
+        """
+        Args:
+            base (float): delay after the first failure (in s)
+            factor (float): multiplier applied after every further failure
+            maximum (float): upper bound of the delay before jitter (in s)
+            jitter (float): relative jitter, the delay is spread by +/- jitter
+        """
+        self.base = base
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter
+
+    def delay(self, attempt: int, rng: random.Random = random) -> float:
+        """Get delay before retrying
+
+        Args:
+            attempt (int): number of consecutive failures, from 1
+            rng (random.Random): random generator for the jitter
+
+        Returns:
+            float: delay (in s)
+        """
+        delay = min(self.maximum, self.base * self.factor ** (attempt - 1))
+        return delay * (1 + rng.uniform(-self.jitter, self.jitter))
+
+
+# default backoff per failure class
+DEFAULT_BACKOFF_POLICIES = {
+    # addresses usually come back within seconds after a reattachment
+    FailureClass.INTERFACE: BackoffPolicy(10, 2, 600, 0.2),
+    # the server or the link may be down for a while
+    FailureClass.MEASUREMENT: BackoffPolicy(60, 2, 1800, 0.3),
+    # local disk or CPU trouble does not go away quickly
+    FailureClass.COMPRESSION: BackoffPolicy(60, 2, 1800, 0.1),
+    FailureClass.PUBLISH: BackoffPolicy(60, 2, 1800, 0.1),
+    # space comes back once the uplink sync catches up
+    FailureClass.STORAGE: BackoffPolicy(300, 2, 3600, 0.1),
+    FailureClass.OTHER: BackoffPolicy(300, 1, 300, 0.1),
+}
+
+
+class RetryPolicy:
+    """Class applying a backoff policy per failure class and counting failures"""
+
+    def __init__(self, policies: dict = None, rng: random.Random = None):
+        """
+        Args:
+            policies (dict): BackoffPolicy per FailureClass, defaults if None
+            rng (random.Random): random generator for the jitter
+        """
+        self.policies = dict(DEFAULT_BACKOFF_POLICIES)
+        if policies is not None:
+            self.policies.update(policies)
+        self.rng = rng if rng is not None else random.Random()
+        # consecutive failures per class since the last success
+        self.attempts = {failure_class: 0 for failure_class in FailureClass}
+        # total failures per class
+        self.failures = {failure_class: 0 for failure_class in FailureClass}
+        self.successes = 0
+
+    def failure(self, failure_class: FailureClass) -> float:
+        """Record a failure
+
+        Args:
+            failure_class (FailureClass): cause of the failure
+
+        Returns:
+            float: delay before retrying (in s)
+        """
+        self.attempts[failure_class] += 1
+        self.failures[failure_class] += 1
+        return self.policies[failure_class].delay(
+            self.attempts[failure_class], self.rng
+        )
+
+    def success(self):
+        """Record a successful cycle, resetting the backoff of every class"""
+        self.successes += 1
+        for failure_class in FailureClass:
+            self.attempts[failure_class] = 0
+
+    def counters(self) -> dict:
+        """Get counters
+
+        Returns:
+            dict: number of successes and of failures per class
+        """
+        counters = {"success": self.successes}
+        for failure_class, failures in self.failures.items():
+            counters[failure_class.value] = failures
+        return counters
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Measurement Scheduler for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+
+# ###### Constants ##########################################################
+# bounds of the cron fields: minute, hour, day of month, month, day of week
+CRON_FIELD_BOUNDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+# maximum time searched for the next cron slot (in days)
+CRON_SEARCH_DAYS = 366 * 5
+
+
+def node_offset(node_id: int, instance: int, spread: int) -> int:
+    """Get deterministic offset of a node within the slot
+
+    Args:
+        node_id (int): node ID
+        instance (int): measurement instance ID
+        spread (int): offsets are within [0, spread) (in s)
+
+    Returns:
+        int: offset (in s)
+    """
+    if spread <= 0:
+        return 0
+    digest = hashlib.sha256(f"{node_id}:{instance}".encode("ascii")).digest()
+    return int.from_bytes(digest[:8], "big") % spread
+
+
+class IntervalScheduler:
+    """Class scheduling runs on wall-clock slots aligned to the epoch
+
+    With a 6 h interval, slots are at 00:00, 06:00, 12:00 and 18:00 UTC plus
+    the offset, whatever the duration of the previous run.
+    """
+
+    def __init__(self, interval: int, offset: int = 0):
+        """
+        Args:
+            interval (int): time between two slots (in s), 0 to run back to back
+            offset (int): offset of the runs within the slot (in s)
+        """
+        self.interval = interval
+        self.offset = offset % interval if interval > 0 else 0
+
+    def next_run(self, now: float) -> float:
+        """Get time of the next run strictly after now
+
+        Args:
+            now (float): current UNIX time
+
+        Returns:
+            float: UNIX time of the next run
+        """
+        if self.interval <= 0:
+            return now
+        slot = (now - self.offset) // self.interval + 1
+        return slot * self.interval + self.offset
+
+
+def parse_cron_field(field: str, low: int, high: int) -> set:
+    """Parse a cron field into the set of values it matches
+
+    Supports "*", single values, ranges "a-b", steps "*/n" or "a-b/n" and
+    comma-separated lists of those.
+
+    Args:
+        field (str): cron field
+        low (int): lowest value of the field
+        high (int): highest value of the field
+
+    Returns:
+        set: matched values
+    """
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"invalid step in cron field {field}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = end = int(part)
+            if step > 1:
+                end = high
+        if (start < low) or (end > high) or (start > end):
+            raise ValueError(f"cron field {field} is not within [{low}, {high}]")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronScheduler:
+    """Class scheduling runs from a cron expression evaluated in UTC
+
+    The expression has the five usual fields "minute hour day-of-month month
+    day-of-week", e.g. "0 */6 * * *" for every 6 h at :00. As with cron, when
+    both day fields are restricted a day matching either of them is used.
+    """
+
+    def __init__(self, expression: str, offset: int = 0):
+        """
+        Args:
+            expression (str): cron expression
+            offset (int): offset of the runs after the cron slots (in s)
+        """
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression {expression} has not 5 fields")
+        self.expression = expression
+        self.offset = offset
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            parse_cron_field(field, low, high)
+            for field, (low, high) in zip(fields, CRON_FIELD_BOUNDS)
+        ]
+        # 7 is also Sunday for cron
+        self.weekdays = {weekday % 7 for weekday in self.weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def is_day_matching(self, day: datetime) -> bool:
+        """Check if a day matches the day fields
+
+        Args:
+            day (datetime): day to check
+
+        Returns:
+            bool: True if the day matches
+        """
+        if day.month not in self.months:
+            return False
+        # cron counts days of week from Sunday
+        is_day = day.day in self.days
+        is_weekday = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return is_day and is_weekday
+        return is_day or is_weekday
+
+    def next_run(self, now: float) -> float:
+        """Get time of the next run strictly after now
+
+        Args:
+            now (float): current UNIX time
+
+        Returns:
+            float: UNIX time of the next run
+        """
+        start = datetime.fromtimestamp(now - self.offset, timezone.utc)
+        # cron slots are on whole minutes
+        candidate = start.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end = candidate + timedelta(days=CRON_SEARCH_DAYS)
+        while candidate < end:
+            if not self.is_day_matching(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate.timestamp() + self.offset
+        raise ValueError(f"cron expression {self.expression} never matches")
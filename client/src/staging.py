@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Result Staging for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import logging
+import os
+
+
+# ###### Constants ##########################################################
+# prefix of the files counted against the memory budget
+STAGED_FILE_PREFIX = "netperfmeter_"
+
+
+class StagingArea:
+    """Class choosing where the raw results of a run are written
+
+    Raw results go to a memory-backed directory (e.g. on /dev/shm) as long
+    as the files staged there plus the expected size of the run fit in a
+    byte budget, and to a disk directory otherwise. The expected size of a
+    run is the largest size seen so far.
+    """
+
+    def __init__(self, memory_directory: str, disk_directory: str, budget_bytes: int):
+        """
+        Args:
+            memory_directory (str): memory-backed directory, None to stage on disk
+            disk_directory (str): directory used when the budget is exceeded
+            budget_bytes (int): budget of the memory-backed directory
+        """
+        self.memory_directory = memory_directory
+        self.disk_directory = disk_directory
+        self.budget_bytes = budget_bytes
+        self.expected_bytes = 0
+        # runs staged in memory and on disk
+        self.memory_runs = 0
+        self.disk_runs = 0
+        if memory_directory is not None:
+            os.makedirs(memory_directory, 0o755, True)
+
+    def directories(self) -> list:
+        """Get the staging directories
+
+        Returns:
+            list: paths to the directories results may be staged in
+        """
+        if self.memory_directory is None:
+            return [self.disk_directory]
+        return [self.memory_directory, self.disk_directory]
+
+    def used_bytes(self) -> int:
+        """Get size of the files staged in memory
+
+        Returns:
+            int: bytes used in the memory-backed directory
+        """
+        used = 0
+        if self.memory_directory is not None:
+            for entry in os.scandir(self.memory_directory):
+                if entry.name.startswith(STAGED_FILE_PREFIX) and entry.is_file():
+                    try:
+                        used += entry.stat().st_size
+                    except FileNotFoundError:
+                        pass
+        return used
+
+    def directory(self) -> str:
+        """Choose the directory of the next run
+
+        Returns:
+            str: memory-backed directory if the run fits in the budget,
+                disk directory otherwise
+        """
+        if self.memory_directory is not None:
+            used = self.used_bytes()
+            if used + self.expected_bytes <= self.budget_bytes:
+                self.memory_runs += 1
+                return self.memory_directory
+            logging.info(
+                "Staging on disk: %d bytes used in memory, %d expected, budget %d",
+                used,
+                self.expected_bytes,
+                self.budget_bytes,
+            )
+        self.disk_runs += 1
+        return self.disk_directory
+
+    def record(self, file_paths: list):
+        """Record the size of the raw results of a run
+
+        Args:
+            file_paths (list): paths to the raw results of the run
+        """
+        size = 0
+        for file_path in file_paths:
+            try:
+                size += os.path.getsize(file_path)
+            except FileNotFoundError:
+                pass
+        self.expected_bytes = max(self.expected_bytes, size)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Run Summary for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+# Ubuntu/Debian dependencies:
+# python3-numpy
+
+import argparse
+import json
+import os
+import sys
+from vectors import VectorReader, iter_scalars, numpy
+
+
+# ###### Constants ##########################################################
+# vector actions and the direction they describe, seen from the node
+DIRECTIONS = {"Sent": "outgoing", "Received": "incoming", "Lost": "lost"}
+# percentiles reported for jitter
+PERCENTILES = [50, 90, 95, 99]
+# log-spaced jitter histogram bin edges in ms, about 2% wide, so memory stays fixed
+HISTOGRAM_EDGES = numpy.geomspace(1e-3, 1e5, 801) if numpy is not None else None
+# netperfmeter vectors count bytes, packets and frames per interval, but carry no
+# time stamp per packet, so one-way delay can not be derived from them
+DELAY_UNAVAILABLE = "not recorded in netperfmeter vectors"
+
+
+class Histogram:
+    """Class counting samples in fixed bins to estimate percentiles"""
+
+    def __init__(self, edges):
+        self.edges = edges
+        # bin 0 is below the first edge, the last bin above the last edge
+        self.counts = numpy.zeros(len(edges) + 1, dtype=numpy.int64)
+        self.minimum = None
+        self.maximum = None
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    def add(self, samples):
+        """Add samples, ignoring non-finite ones
+
+        Args:
+            samples (numpy.ndarray): samples
+        """
+        samples = samples[numpy.isfinite(samples)]
+        if len(samples) == 0:
+            return
+        self.counts += numpy.bincount(
+            numpy.searchsorted(self.edges, samples, side="right"),
+            minlength=len(self.counts),
+        )
+        minimum = float(samples.min())
+        maximum = float(samples.max())
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    def percentiles(self) -> dict:
+        """Get estimated percentiles
+
+        Returns:
+            dict: value per percentile, the geometric bin center clamped to the
+                  sample range, empty if there is no sample
+        """
+        total = len(self)
+        if total == 0:
+            return {}
+        cumulative = numpy.cumsum(self.counts)
+        result = {}
+        for p in PERCENTILES:
+            index = int(numpy.searchsorted(cumulative, total * p / 100))
+            if index == 0:
+                value = self.minimum
+            elif index == len(self.edges):
+                value = self.maximum
+            else:
+                value = float(numpy.sqrt(self.edges[index - 1] * self.edges[index]))
+            value = min(max(value, self.minimum), self.maximum)
+            result[f"p{p}"] = round(value, 6)
+        return result
+
+
+class FlowAccumulator:
+    """Class accumulating the vector rows of one flow and action"""
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.packets = 0
+        self.frames = 0
+        self.start = None
+        self.end = None
+        self.jitter = Histogram(HISTOGRAM_EDGES)
+
+    def add(self, chunk):
+        """Add vector rows
+
+        Args:
+            chunk (numpy.ndarray): structured array of rows of this flow and action
+        """
+        names = chunk.dtype.names
+        self.rows += len(chunk)
+        for counter in ["bytes", "packets", "frames"]:
+            if f"rel_{counter}" in names:
+                setattr(
+                    self,
+                    counter,
+                    getattr(self, counter) + int(chunk[f"rel_{counter}"].sum()),
+                )
+        # the time covered by a row ends at its time stamp
+        if ("rel_time" in names) and ("interval" in names):
+            start = float((chunk["rel_time"] - chunk["interval"]).min())
+            end = float(chunk["rel_time"].max())
+            self.start = start if self.start is None else min(self.start, start)
+            self.end = end if self.end is None else max(self.end, end)
+        if "jitter" in names:
+            self.jitter.add(chunk["jitter"])
+
+    def summary(self) -> dict:
+        """Get summary of the accumulated rows
+
+        Returns:
+            dict: totals, duration, throughput and jitter percentiles
+        """
+        duration = 0.0
+        if self.start is not None:
+            duration = max(0.0, self.end - self.start)
+        summary = {
+            "bytes": self.bytes,
+            "packets": self.packets,
+            "frames": self.frames,
+            "duration": round(duration, 6),
+            "throughput_bps": round(self.bytes * 8 / duration, 3) if duration else 0.0,
+        }
+        if len(self.jitter):
+            summary["jitter"] = self.jitter.percentiles()
+        return summary
+
+
+def summarize_vector(file_path: str) -> list:
+    """Summarize a vector file per flow and direction
+
+    Args:
+        file_path (str): path to a plain or compressed vector file
+
+    Returns:
+        list: summary of every flow
+    """
+    if numpy is None:
+        raise RuntimeError("summary requires the numpy module")
+    accumulators = {}
+    for chunk in VectorReader(file_path).iter_arrays():
+        names = chunk.dtype.names
+        if ("flow_id" not in names) or ("action" not in names):
+            continue
+        for flow_id in numpy.unique(chunk["flow_id"]):
+            flow_rows = chunk[chunk["flow_id"] == flow_id]
+            for action, direction in DIRECTIONS.items():
+                rows = flow_rows[flow_rows["action"] == action]
+                if len(rows) == 0:
+                    continue
+                description = (
+                    str(rows["description"][0]) if ("description" in names) else ""
+                )
+                key = (int(flow_id), description)
+                accumulator = accumulators.setdefault(key, {}).setdefault(
+                    direction, FlowAccumulator()
+                )
+                accumulator.add(rows)
+    flows = []
+    for (flow_id, description), directions in sorted(accumulators.items()):
+        flow = {"flow_id": flow_id, "description": description}
+        for direction, accumulator in directions.items():
+            flow[direction] = accumulator.summary()
+        # frames lost on the incoming direction
+        if ("incoming" in flow) and ("lost" in flow):
+            expected = flow["incoming"]["frames"] + flow["lost"]["frames"]
+            flow["frame_loss"] = (
+                round(flow["lost"]["frames"] / expected, 6) if expected else 0.0
+            )
+        flows.append(flow)
+    return flows
+
+
+def summarize_run(vector_paths: list, scalar_paths: list) -> dict:
+    """Summarize the result files of a run
+
+    Args:
+        vector_paths (list): paths to the vector files of the run
+        scalar_paths (list): paths to the scalar files of the run
+
+    Returns:
+        dict: flow summaries per vector file and scalars per scalar file
+    """
+    summary = {"vectors": {}, "scalars": {}, "delay": DELAY_UNAVAILABLE}
+    for vector_path in vector_paths:
+        summary["vectors"][os.path.basename(vector_path)] = summarize_vector(
+            vector_path
+        )
+    for scalar_path in scalar_paths:
+        scalars = {}
+        for scalar in iter_scalars(scalar_path):
+            scalars.setdefault(scalar.object, {})[scalar.name] = scalar.value
+        summary["scalars"][os.path.basename(scalar_path)] = scalars
+    return summary
+
+
+def write_summary(summary: dict, file_path: str):
+    """Write summary as JSON, atomically
+
+    Args:
+        summary (dict): summary of a run
+        file_path (str): path to the JSON file
+    """
+    tmp_file = f"{file_path}.tmp"
+    with open(tmp_file, "w") as summary_file:
+        json.dump(summary, summary_file, indent=1)
+    os.replace(tmp_file, file_path)
+
+
+if __name__ == "__main__":
+    # ###### Summarize result files #############################################
+    ap = argparse.ArgumentParser(description="Summarize netperfmeter results")
+    ap.add_argument("vectors", help="Vector files", type=str, nargs="*")
+    ap.add_argument(
+        "-s", "--scalars", help="Scalar files", type=str, nargs="*", default=[]
+    )
+    options = ap.parse_args()
+    try:
+        json.dump(summarize_run(options.vectors, options.scalars), sys.stdout, indent=1)
+    except Exception as e:
+        sys.stderr.write(f"ERROR: Unable to summarize results: {e}\n")
+        sys.exit(1)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Traffic Profiles for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import argparse
+import json
+import math
+import sys
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+# ###### Constants ##########################################################
+# transport protocols of netperfmeter flows
+PROTOCOLS = ["tcp", "udp", "sctp", "dccp"]
+# number of parameters of every distribution
+DISTRIBUTIONS = {"const": 1, "exp": 1, "uniform": 2, "pareto": 2}
+# directions of a flow, in netperfmeter order
+DIRECTIONS = ["outgoing", "incoming"]
+
+
+def compile_distribution(spec, where: str) -> str:
+    """Compile a distribution into netperfmeter syntax
+
+    A distribution is a number (constant), or an object with one key among
+    DISTRIBUTIONS, e.g. {"exp": 10} (mean), {"uniform": [100, 1400]} (lower
+    and upper bound) or {"pareto": [1.0, 2.5]} (location and shape).
+
+    Args:
+        spec: distribution
+        where (str): location in the profile, for errors
+
+    Returns:
+        str: distribution, e.g. "uniform100,1400"
+    """
+    if isinstance(spec, (int, float)) and not isinstance(spec, bool):
+        spec = {"const": spec}
+    if (not isinstance(spec, dict)) or (len(spec) != 1):
+        raise ValueError(f"{where}: expected a number or one distribution")
+    name, parameters = next(iter(spec.items()))
+    if name not in DISTRIBUTIONS:
+        raise ValueError(f"{where}: unknown distribution {name}")
+    if not isinstance(parameters, list):
+        parameters = [parameters]
+    if (len(parameters) != DISTRIBUTIONS[name]) or not all(
+        isinstance(parameter, (int, float)) and not isinstance(parameter, bool)
+        for parameter in parameters
+    ):
+        raise ValueError(
+            f"{where}: {name} takes {DISTRIBUTIONS[name]} numeric parameters"
+        )
+    if not all(math.isfinite(parameter) for parameter in parameters):
+        raise ValueError(f"{where}: parameters must be finite")
+    if name == "const":
+        if parameters[0] < 0:
+            raise ValueError(f"{where}: constant must not be negative")
+    elif name == "uniform":
+        if not 0 <= parameters[0] <= parameters[1]:
+            raise ValueError(f"{where}: uniform needs 0 <= lower <= upper")
+    elif any(parameter <= 0 for parameter in parameters):
+        # exp mean, pareto location and shape
+        raise ValueError(f"{where}: {name} parameters must be positive")
+    return name + ",".join(str(parameter) for parameter in parameters)
+
+
+def compile_flow(flow: dict, where: str) -> list:
+    """Compile a flow into netperfmeter arguments
+
+    A flow gives its protocol, the frame rate (in frames/s) and frame size
+    (in bytes) of each direction, unset ones being 0, and optionally a
+    description, on/off toggle times (in s, the flow being off until the
+    first one) and further netperfmeter flow options.
+
+    Args:
+        flow (dict): flow
+        where (str): location in the profile, for errors
+
+    Returns:
+        list: protocol argument and flow specification
+    """
+    if not isinstance(flow, dict):
+        raise ValueError(f"{where}: expected an object")
+    unknown = set(flow) - {"protocol", "description", "onoff", "options", *DIRECTIONS}
+    if unknown:
+        raise ValueError(f"{where}: unknown keys {', '.join(sorted(unknown))}")
+    protocol = flow.get("protocol")
+    if protocol not in PROTOCOLS:
+        raise ValueError(f"{where}.protocol: expected one of {', '.join(PROTOCOLS)}")
+    fields = []
+    for direction in DIRECTIONS:
+        traffic = flow.get(direction, {})
+        if (not isinstance(traffic, dict)) or (set(traffic) - {"rate", "size"}):
+            raise ValueError(f"{where}.{direction}: expected rate and size")
+        for key in ["rate", "size"]:
+            fields.append(
+                compile_distribution(traffic.get(key, 0), f"{where}.{direction}.{key}")
+            )
+    if "description" in flow:
+        # ":" separates the fields of the specification
+        fields.append(f"description={str(flow['description']).replace(':', '_')}")
+    if "onoff" in flow:
+        if (not isinstance(flow["onoff"], list)) or (not flow["onoff"]):
+            raise ValueError(f"{where}.onoff: expected a list of toggle times")
+        events = []
+        for i, event in enumerate(flow["onoff"]):
+            time = compile_distribution(event, f"{where}.onoff[{i}]")
+            # constant times are given as plain numbers
+            events.append(
+                "+" + (time[len("const") :] if time.startswith("const") else time)
+            )
+        fields.append("onoff=" + ",".join(events))
+    options = flow.get("options", {})
+    if not isinstance(options, dict):
+        raise ValueError(f"{where}.options: expected an object")
+    for key, value in options.items():
+        # ":" separates the fields, "=" the key from the value
+        if (not str(key)) or any(separator in str(key) for separator in ":="):
+            raise ValueError(f"{where}.options: invalid option name {key!r}")
+        if ":" in str(value):
+            raise ValueError(f"{where}.options.{key}: value must not contain ':'")
+        fields.append(f"{key}={value}")
+    return [f"-{protocol}", ":".join(fields)]
+
+
+def compile_profile(profile: dict) -> list:
+    """Compile a traffic profile into netperfmeter arguments
+
+    Args:
+        profile (dict): profile, with its flows in "flows"
+
+    Returns:
+        list: protocol argument and specification of every flow
+    """
+    if (not isinstance(profile, dict)) or (not isinstance(profile.get("flows"), list)):
+        raise ValueError("expected an object with a list of flows")
+    if not profile["flows"]:
+        raise ValueError("flows: expected at least one flow")
+    arguments = []
+    for i, flow in enumerate(profile["flows"]):
+        arguments += compile_flow(flow, f"flows[{i}]")
+    return arguments
+
+
+def load_profile(profile_path: str) -> list:
+    """Load and compile a traffic profile file, in YAML if available or JSON
+
+    Args:
+        profile_path (str): path to the profile
+
+    Returns:
+        list: netperfmeter arguments of the flows
+    """
+    with open(profile_path) as profile_file:
+        if (yaml is not None) and profile_path.endswith((".yaml", ".yml")):
+            profile = yaml.safe_load(profile_file)
+        else:
+            profile = json.load(profile_file)
+    return compile_profile(profile)
+
+
+if __name__ == "__main__":
+    # ###### Compile traffic profile ############################################
+    ap = argparse.ArgumentParser(description="Compile a traffic profile")
+    ap.add_argument("profile", help="Path to the profile", type=str)
+    options = ap.parse_args()
+    try:
+        sys.stdout.write(" ".join(load_profile(options.profile)) + "\n")
+    except Exception as e:
+        sys.stderr.write(f"ERROR: Invalid profile {options.profile}: {e}\n")
+        sys.exit(1)
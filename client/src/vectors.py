@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Netperfmeter Vector and Scalar File Parser
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+# Ubuntu/Debian optional dependencies:
+# python3-numpy (bulk mode only), python3-zstandard (zstd input only)
+
+import bz2
+import io
+import lzma
+import re
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# ###### Constants ##########################################################
+# magic numbers of the supported compressed formats
+BZ2_MAGIC = b"BZh"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# number of rows per array in bulk mode
+DEFAULT_CHUNK_ROWS = 65536
+# width of string columns in bulk mode
+STRING_COLUMN_WIDTH = 32
+# integer columns besides the ones named *Bytes, *Packets and *Frames
+INTEGER_COLUMNS = {"FlowID"}
+# string columns, quoted in the files
+STRING_COLUMNS = {"Description", "Action"}
+# tokens of a line: quoted strings or words
+TOKEN_PATTERN = re.compile(r'"[^"]*"|\S+')
+
+ScalarRecord = namedtuple("ScalarRecord", ["object", "name", "value"])
+
+
+def open_result_file(file_path: str, dictionary: bytes = None):
+    """Open a result file as text, whatever its compression
+
+    Args:
+        file_path (str): path to a plain, bzip2, xz or zstd file
+        dictionary (bytes): zstd dictionary the file was compressed with
+
+    Returns:
+        io.TextIOBase: text stream of the decompressed file
+    """
+    with open(file_path, "rb") as result_file:
+        magic = result_file.read(len(XZ_MAGIC))
+    if magic.startswith(BZ2_MAGIC):
+        return bz2.open(file_path, "rt", encoding="utf-8")
+    if magic.startswith(XZ_MAGIC):
+        return lzma.open(file_path, "rt", encoding="utf-8")
+    if magic.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("zstd input requires the zstandard module")
+        decompressor = zstandard.ZstdDecompressor(
+            dict_data=(
+                zstandard.ZstdCompressionDict(dictionary)
+                if dictionary is not None
+                else None
+            )
+        )
+        return io.TextIOWrapper(
+            decompressor.stream_reader(open(file_path, "rb"), closefd=True),
+            encoding="utf-8",
+        )
+    return open(file_path, "rt", encoding="utf-8")
+
+
+def field_name(column: str) -> str:
+    """Get record field name of a column, e.g. "AbsTime" becomes "abs_time"
+
+    Args:
+        column (str): column name in the file header
+
+    Returns:
+        str: field name
+    """
+    name = re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", "_", column)
+    name = re.sub(r"\W", "_", name).lower()
+    return name if name.isidentifier() else f"column_{name}"
+
+
+def column_type(column: str) -> type:
+    """Get Python type of a column
+
+    Args:
+        column (str): column name in the file header
+
+    Returns:
+        type: int, float or str
+    """
+    if column in STRING_COLUMNS:
+        return str
+    if (column in INTEGER_COLUMNS) or column.endswith(("Bytes", "Packets", "Frames")):
+        return int
+    return float
+
+
+def split_line(line: str) -> list:
+    """Split a line into tokens, keeping quoted strings together
+
+    Args:
+        line (str): line of a vector or scalar file
+
+    Returns:
+        list: tokens, quotes removed
+    """
+    if '"' not in line:
+        return line.split()
+    return [token.strip('"') for token in TOKEN_PATTERN.findall(line)]
+
+
+class VectorReader:
+    """Class streaming the rows of a netperfmeter vector file
+
+    Vector files are whitespace-separated tables with a header line, e.g.
+    "AbsTime RelTime Interval FlowID Description Jitter Action AbsBytes ...".
+    As in R tables, rows may start with an extra row name, which is dropped.
+    Rows are read one at a time, so memory does not depend on the file size.
+    """
+
+    def __init__(self, file_path: str, dictionary: bytes = None):
+        """
+        Args:
+            file_path (str): path to a plain or compressed vector file
+            dictionary (bytes): zstd dictionary the file was compressed with
+        """
+        self.file_path = file_path
+        self.dictionary = dictionary
+        self.columns = None
+        self.record_type = None
+
+    def _read_header(self, stream):
+        for line in stream:
+            tokens = split_line(line)
+            if tokens:
+                self.columns = tokens
+                self.record_type = namedtuple(
+                    "VectorRecord", [field_name(column) for column in tokens]
+                )
+                return
+        self.columns = []
+        self.record_type = namedtuple("VectorRecord", [])
+
+    def iter_tokens(self):
+        """Iterate over the rows of the file as lists of tokens
+
+        Yields:
+            list: tokens of a row, one per column
+        """
+        with open_result_file(self.file_path, self.dictionary) as stream:
+            self._read_header(stream)
+            width = len(self.columns)
+            for line in stream:
+                tokens = split_line(line)
+                if len(tokens) == width + 1:
+                    tokens = tokens[1:]
+                elif len(tokens) != width:
+                    continue
+                yield tokens
+
+    def __iter__(self):
+        """Iterate over the typed rows of the file
+
+        Yields:
+            VectorRecord: named tuple with one typed field per column
+        """
+        converters = None
+        for tokens in self.iter_tokens():
+            if converters is None:
+                converters = [column_type(column) for column in self.columns]
+            yield self.record_type._make(
+                [converter(token) for converter, token in zip(converters, tokens)]
+            )
+
+    def iter_arrays(self, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        """Iterate over the rows of the file as NumPy structured arrays
+
+        Args:
+            chunk_rows (int): maximum number of rows per array
+
+        Yields:
+            numpy.ndarray: structured array with one field per column
+        """
+        if numpy is None:
+            raise RuntimeError("bulk mode requires the numpy module")
+        dtype = None
+        rows = []
+        for tokens in self.iter_tokens():
+            if dtype is None:
+                dtype = vector_dtype(self.columns)
+                converters = [column_type(column) for column in self.columns]
+            rows.append(
+                tuple(converter(token) for converter, token in zip(converters, tokens))
+            )
+            if len(rows) >= chunk_rows:
+                yield numpy.array(rows, dtype=dtype)
+                rows = []
+        if rows:
+            yield numpy.array(rows, dtype=dtype)
+
+
+def vector_dtype(columns: list):
+    """Get NumPy structured dtype of vector columns
+
+    Args:
+        columns (list): column names in the file header
+
+    Returns:
+        numpy.dtype: dtype with one field per column
+    """
+    types = {int: numpy.int64, float: numpy.float64, str: f"U{STRING_COLUMN_WIDTH}"}
+    return numpy.dtype(
+        [(field_name(column), types[column_type(column)]) for column in columns]
+    )
+
+
+def iter_vector(file_path: str, dictionary: bytes = None):
+    """Iterate over the typed rows of a vector file
+
+    Args:
+        file_path (str): path to a plain or compressed vector file
+        dictionary (bytes): zstd dictionary the file was compressed with
+
+    Yields:
+        VectorRecord: named tuple with one typed field per column
+    """
+    return iter(VectorReader(file_path, dictionary))
+
+
+def read_vector_array(file_path: str, dictionary: bytes = None):
+    """Read a whole vector file into a NumPy structured array
+
+    Args:
+        file_path (str): path to a plain or compressed vector file
+        dictionary (bytes): zstd dictionary the file was compressed with
+
+    Returns:
+        numpy.ndarray: structured array with one field per column
+    """
+    reader = VectorReader(file_path, dictionary)
+    chunks = list(reader.iter_arrays())
+    if not chunks:
+        return numpy.zeros(0, dtype=vector_dtype(reader.columns))
+    return numpy.concatenate(chunks)
+
+
+def iter_scalars(file_path: str, dictionary: bytes = None):
+    """Iterate over the scalars of a scalar file
+
+    Scalar files follow the OMNeT++ format, with lines such as
+    'scalar "netPerfMeter.active.flow[0]" "Sent Bytes" 12345'. Other lines
+    ("run", "attr", ...) are skipped.
+
+    Args:
+        file_path (str): path to a plain or compressed scalar file
+        dictionary (bytes): zstd dictionary the file was compressed with
+
+    Yields:
+        ScalarRecord: object, name and value of a scalar
+    """
+    with open_result_file(file_path, dictionary) as stream:
+        for line in stream:
+            tokens = split_line(line)
+            if (len(tokens) == 4) and (tokens[0] == "scalar"):
+                try:
+                    value = float(tokens[3])
+                except ValueError:
+                    continue
+                yield ScalarRecord(tokens[1], tokens[2], value)
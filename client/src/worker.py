@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# =================================================================
+#          #     #                 #     #
+#          ##    #   ####   #####  ##    #  ######   #####
+#          # #   #  #    #  #    # # #   #  #          #
+#          #  #  #  #    #  #    # #  #  #  #####      #
+#          #   # #  #    #  #####  #   # #  #          #
+#          #    ##  #    #  #   #  #    ##  #          #
+#          #     #   ####   #    # #     #  ######     #
+#
+#       ---   The NorNet Testbed for Multi-Homed Systems  ---
+#                       https://www.nntb.no
+# =================================================================
+#
+# Background Post-Processing for the Netperfmeter Experiment
+#
+# Copyright (C) 2024 by Hugo Martineau
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact: hugom@simula.no
+
+
+import contextlib
+import ctypes
+import logging
+import multiprocessing
+import os
+import platform
+import queue
+import threading
+import time
+from logsetup import DUMP_EXTRA
+from retry import FailureClass, RetryPolicy
+
+
+# ###### Constants ##########################################################
+# ioprio_set system call number per machine
+IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "i686": 289,
+    "aarch64": 30,
+    "armv7l": 314,
+}
+# ioprio_set target and class, see ioprio_set(2)
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+# nice value used when SCHED_IDLE is not available
+IDLE_NICE = 19
+
+
+def set_idle_priority(cpu: bool = True):
+    """Lower CPU and I/O priority of the calling thread to idle
+
+    The thread gets SCHED_IDLE (or nice 19) and the idle I/O class, so it
+    only runs when nothing else needs the CPU or the disk. Threads it starts
+    inherit these priorities. Failures are logged and ignored.
+
+    Args:
+        cpu (bool): lower the CPU priority too, not only the I/O priority
+    """
+    thread_id = threading.get_native_id()
+    if cpu:
+        try:
+            os.sched_setscheduler(thread_id, os.SCHED_IDLE, os.sched_param(0))
+        except (AttributeError, OSError):
+            try:
+                os.setpriority(os.PRIO_PROCESS, thread_id, IDLE_NICE)
+            except OSError as e:
+                logging.debug("Cannot lower CPU priority: %s", str(e))
+    syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall is None:
+        logging.debug("Cannot lower I/O priority on %s", platform.machine())
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    if (
+        libc.syscall(
+            syscall,
+            IOPRIO_WHO_PROCESS,
+            thread_id,
+            IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT,
+        )
+        != 0
+    ):
+        logging.debug("Cannot lower I/O priority: %s", os.strerror(ctypes.get_errno()))
+
+
+def run_step(connection, function, args: tuple):
+    """Run a function in a step process at idle priority and send back its
+    outcome
+
+    Args:
+        connection (multiprocessing.connection.Connection): sending end of a pipe
+        function (callable): function to run
+        args (tuple): arguments of the function
+    """
+    set_idle_priority()
+    try:
+        outcome = (True, function(*args))
+    except Exception as e:
+        outcome = (False, e)
+    connection.send(outcome)
+    connection.close()
+
+
+class BackgroundWorker:
+    """Class processing jobs in a background thread at idle I/O priority
+
+    Jobs are processed in order. The job function splits its work into steps
+    with step(), and no step starts while a measurement is running. A
+    measurement waits for the current step for a bounded time, since a step
+    may be a whole file, then runs alongside it: files written since
+    step_time may still be in use. CPU-heavy work is run with call() in a
+    child process at idle CPU priority, as a thread at idle CPU priority
+    could hold the interpreter lock while the measurement saturates the CPU.
+    A failed job is queued again after the backoff of its failure class,
+    given by the failure_class of a ClassifiedError.
+    """
+
+    def __init__(self, process, name: str = "worker", retry_policy: RetryPolicy = None):
+        """
+        Args:
+            process (callable): function processing a job, called as process(job)
+            name (str): thread name
+            retry_policy (RetryPolicy): backoff of failed jobs, default if None
+        """
+        self.process = process
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.queue = queue.Queue()
+        self.condition = threading.Condition()
+        self.measuring = False
+        self.working = False
+        # wall-clock start time of the running step, None if no step runs
+        self.step_time = None
+        # set once the stop marker is queued
+        self.draining = False
+        # job counters and latencies from submission to completion (in s)
+        self.done = 0
+        self.failed = 0
+        # failed jobs waiting for their retry
+        self.retrying = 0
+        self.last_latency = None
+        self.max_latency = 0.0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, job):
+        """Queue a job
+
+        Args:
+            job: job passed to the process function
+        """
+        self.queue.put((time.monotonic(), job))
+
+    @contextlib.contextmanager
+    def measurement(self, timeout: float = None):
+        """Context of a measurement, during which no step starts
+
+        Args:
+            timeout (float): maximum time to wait for the current step (in s),
+                no limit if None
+        """
+        with self.condition:
+            start = time.monotonic()
+            if not self.condition.wait_for(lambda: not self.working, timeout):
+                logging.warning(
+                    "Background step still running after %.0f s, measuring alongside it",
+                    timeout,
+                )
+            elif time.monotonic() - start >= 1:
+                logging.debug(
+                    "Measurement waited %.3f s for a background step",
+                    time.monotonic() - start,
+                )
+            self.measuring = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.measuring = False
+                self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def step(self):
+        """Context of a step of a job, waiting for the end of any measurement"""
+        with self.condition:
+            self.condition.wait_for(lambda: not self.measuring)
+            self.working = True
+            self.step_time = time.time()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.working = False
+                self.step_time = None
+                self.condition.notify_all()
+
+    def call(self, function, *args):
+        """Run a function in a child process at idle CPU and I/O priority
+
+        The process is spawned, so it does not inherit locks held by other
+        threads, and reaped before returning, so its CPU time counts as the
+        one of a child.
+
+        Args:
+            function (callable): module-level function, or method of a
+                picklable object
+            args: arguments of the function
+
+        Returns:
+            result of the function
+
+        Raises:
+            Exception: error raised by the function, or RuntimeError if the
+                process exited without a result
+        """
+        context = multiprocessing.get_context("spawn")
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=run_step, args=(sender, function, args), daemon=True
+        )
+        process.start()
+        sender.close()
+        try:
+            outcome = receiver.recv()
+        except EOFError:
+            outcome = None
+        finally:
+            receiver.close()
+            process.join()
+        if outcome is None:
+            raise RuntimeError(f"step process exited with code {process.exitcode}")
+        succeeded, result = outcome
+        if not succeeded:
+            raise result
+        return result
+
+    def _run(self):
+        # CPU-heavy work is left to call()
+        set_idle_priority(cpu=False)
+        while True:
+            submitted, job = self.queue.get()
+            if job is None:
+                return
+            try:
+                self.process(job)
+                self.done += 1
+                self.retry_policy.success()
+            except Exception as e:
+                self.failed += 1
+                self.retry(submitted, job, e)
+            latency = time.monotonic() - submitted
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            logging.debug(
+                "Background job finished %.3f s after submission, %d queued",
+                latency,
+                self.queue.qsize(),
+            )
+
+    def retry(self, submitted: float, job, error: Exception):
+        """Queue a failed job again after the backoff of its failure class
+
+        Args:
+            submitted (float): first submission time of the job (monotonic)
+            job: job passed to the process function
+            error (Exception): error of the job
+        """
+        failure_class = getattr(error, "failure_class", FailureClass.OTHER)
+        delay = self.retry_policy.failure(failure_class)
+        if self.draining:
+            logging.warning(
+                "Background job failed on %s: %s, not retried before stopping",
+                failure_class.value,
+                str(error),
+                extra=DUMP_EXTRA,
+            )
+            return
+        logging.warning(
+            "Background job failed on %s: %s, retrying in %.0f s",
+            failure_class.value,
+            str(error),
+            delay,
+            extra=DUMP_EXTRA,
+        )
+        self.retrying += 1
+
+        def requeue():
+            self.retrying -= 1
+            self.queue.put((submitted, job))
+
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        timer.start()
+
+    def drain(self, timeout: float = None) -> bool:
+        """Process the queued jobs and stop the thread
+
+        Args:
+            timeout (float): maximum time to wait (in s), no limit if None
+
+        Returns:
+            bool: True if every job was processed
+        """
+        self.draining = True
+        self.queue.put((time.monotonic(), None))
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def counters(self) -> dict:
+        """Get counters
+
+        Returns:
+            dict: queue depth, processed, failed and retrying jobs, latencies (in s)
+        """
+        return {
+            "queued": max(0, self.queue.qsize() - self.draining),
+            "done": self.done,
+            "failed": self.failed,
+            "retrying": self.retrying,
+            "last_latency": (
+                round(self.last_latency, 3) if self.last_latency is not None else None
+            ),
+            "max_latency": round(self.max_latency, 3),
+        }